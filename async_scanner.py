@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# async_scanner.py - Concurrent listing fetcher on playwright.async_api
+import asyncio
+import os
+import time
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright
+from browser_pool import (
+    BROWSER_RECYCLE_AFTER,
+    NAVIGATION_TIMEOUT_MS,
+    READY_SELECTOR,
+    READY_TIMEOUT_MS,
+    latency_summary,
+    should_block,
+)
+
+# Pages in flight at once, pages in flight per host, and a hard stop for the
+# whole fetch phase. URLs still pending at the deadline come back as "".
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "4"))
+SCAN_PER_HOST_LIMIT = int(os.getenv("SCAN_PER_HOST_LIMIT", "4"))
+SCAN_DEADLINE_SECONDS = float(os.getenv("SCAN_DEADLINE_SECONDS", "600"))
+
+def log(msg: str):
+    print(msg)
+
+class AsyncScanner:
+    def __init__(self, browser, concurrency=SCAN_CONCURRENCY, per_host=SCAN_PER_HOST_LIMIT,
+                 recycle_after=BROWSER_RECYCLE_AFTER):
+        self.browser = browser
+        self.concurrency = max(1, int(concurrency))
+        self.per_host = max(1, int(per_host))
+        self.recycle_after = max(1, int(recycle_after))
+        self.host_limits = {}
+        self.contexts = asyncio.Queue()
+        self.context_uses = {}
+        self.recycled = 0
+        self.blocked_requests = 0
+        self.ready_timeouts = 0
+        self.fetch_times = []
+
+    async def start(self):
+        for _ in range(self.concurrency):
+            await self._add_context()
+
+    async def _new_context(self):
+        context = await self.browser.new_context()
+        await context.route("**/*", self._route)
+        self.context_uses[context] = 0
+        return context
+
+    async def _add_context(self):
+        self.contexts.put_nowait(await self._new_context())
+
+    async def _route(self, route):
+        request = route.request
+        if should_block(request.resource_type, request.url):
+            self.blocked_requests += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _release_context(self, context, crashed=False):
+        self.context_uses[context] += 1
+        if crashed or self.context_uses[context] >= self.recycle_after:
+            self.context_uses.pop(context, None)
+            try:
+                await context.close()
+            except Exception as e:
+                log(f"Error closing browser context: {e}")
+            self.recycled += 1
+            try:
+                await self._add_context()
+            except Exception as e:
+                # Keep the slot as None so the pool does not shrink; the next fetch retries
+                log(f"Error replacing browser context: {e}")
+                self.contexts.put_nowait(None)
+            return
+        self.contexts.put_nowait(context)
+
+    def _host_limit(self, url: str):
+        host = urlparse(url).netloc
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self.host_limits[host]
+
+    async def fetch(self, url: str):
+        async with self._host_limit(url):
+            context = await self.contexts.get()
+            if context is None:
+                try:
+                    context = await self._new_context()
+                except Exception as e:
+                    log(f"Error fetching URL {url}: no browser context: {e}")
+                    self.contexts.put_nowait(None)
+                    return ""
+            page = None
+            crashed = False
+            started = time.perf_counter()
+            try:
+                page = await context.new_page()
+                await page.goto(url, wait_until="domcontentloaded", timeout=NAVIGATION_TIMEOUT_MS)
+                try:
+                    await page.wait_for_selector(READY_SELECTOR, state="attached", timeout=READY_TIMEOUT_MS)
+                except Exception:
+                    self.ready_timeouts += 1
+                    log(f"Listing not ready after {READY_TIMEOUT_MS}ms: {url}")
+                return await page.content()
+            except Exception as e:
+                crashed = True
+                log(f"Error fetching URL {url}: {e}")
+                return ""
+            finally:
+                if page:
+                    try:
+                        await page.close()
+                    except Exception:
+                        crashed = True
+                elapsed = time.perf_counter() - started
+                self.fetch_times.append(elapsed)
+                log(f"fetch {elapsed:.2f}s {url}")
+                await self._release_context(context, crashed=crashed)
+
+    async def close(self):
+        while not self.contexts.empty():
+            context = self.contexts.get_nowait()
+            if context is None:
+                continue
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "per_host_limit": self.per_host,
+            "recycled_contexts": self.recycled,
+            "blocked_requests": self.blocked_requests,
+            "ready_timeouts": self.ready_timeouts,
+            "fetch_latency": latency_summary(self.fetch_times),
+        }
+
+async def fetch_pages(urls, concurrency=SCAN_CONCURRENCY, per_host=SCAN_PER_HOST_LIMIT,
+                      deadline_seconds=SCAN_DEADLINE_SECONDS):
+    """Fetch every URL with bounded parallelism. Returns url -> html ("" on failure/timeout)"""
+    pages = {url: "" for url in urls}
+    if not urls:
+        return pages
+
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(headless=True)
+        scanner = AsyncScanner(browser, concurrency=concurrency, per_host=per_host)
+        try:
+            await scanner.start()
+            tasks = {asyncio.ensure_future(scanner.fetch(url)): url for url in urls}
+            done, pending = await asyncio.wait(tasks, timeout=deadline_seconds)
+
+            for task in done:
+                pages[tasks[task]] = task.result()
+
+            if pending:
+                log(f"Scan deadline ({deadline_seconds:.0f}s) hit, abandoning {len(pending)} URLs")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            log(f"Async scanner stats: {scanner.stats()}")
+            await scanner.close()
+            await browser.close()
+
+    return pages
+
+def fetch_pages_sync(urls, **kwargs):
+    """Blocking wrapper so the sync checker can call the async engine"""
+    return asyncio.run(fetch_pages(list(urls), **kwargs))
@@ -1,37 +1,16 @@
 #!/usr/bin/env python3
 # auto_user_manager.py - Auto-manage problematic users
-import json
-import os
-import requests
 from datetime import datetime, timedelta
 
-USER_DATA_FILE = "user_data.json"
-TELEGRAM_BOT_TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN") or "").strip()
-API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
-
-def load_json(path, default):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return default
-
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+from storage import get_store
+from telegram_client import TELEGRAM_BOT_TOKEN, get_client
 
 def send_message(chat_id, text):
-    url = f"{API}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-    try:
-        r = requests.post(url, data=payload, timeout=30)
-        return r.status_code == 200
-    except:
-        return False
+    return get_client().send_message(chat_id, text, disable_web_page_preview=False).ok
 
 def auto_fix_users():
     """Automatically fix common user issues"""
-    user_data = load_json(USER_DATA_FILE, {})
+    user_data = get_store().load_users()
     
     if not user_data:
         print("No users found")
@@ -93,7 +72,7 @@ def auto_fix_users():
 
 def send_mass_message():
     """Send message to all users (for maintenance/updates)"""
-    user_data = load_json(USER_DATA_FILE, {})
+    user_data = get_store().load_users()
     
     # Example maintenance message
     maintenance_msg = (
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# bench_checker.py - End-to-end timberland_checker benchmark with no network
+#
+# Usage: python benchmarks/bench_checker.py [--users 10,1000,10000] [--runs N] [--rate-limit-every N] [listing.html]
+#
+# Starts two local stand-ins in this process:
+#   - a "Timberland" HTTP server answering every listing URL with a recorded
+#     page (benchmarks/fixtures/listing_*.html by default), with an ETag and
+#     304 for a matching If-None-Match, and every coupon source with the
+#     recorded coupon page,
+#   - a fake Telegram Bot API that records each call and answers every Nth
+#     one with 429 + retry_after.
+# For each population size a synthetic user_data.json is generated (seeded,
+# so runs are comparable) in a fresh temp directory, and timberland_checker.main
+# runs in its own subprocess pointed at the stand-ins through
+# TIMBERLAND_BASE_URL / TELEGRAM_API_BASE / COUPON_DYNAMIC_SOURCES. Reported
+# per population: wall time, listing fetches, Telegram API calls by method,
+# injected 429s, peak RSS of the checker process, and its --profile stages
+# (written next to the report as bench_checker_<users>.json). With --runs N
+# the checker runs N times over the same state, so later runs show what an
+# unchanged site costs (listings skipped as unchanged, users caught up).
+#
+# Telegram's real 30 msg/s limit would make a 10k-user run take most of an
+# hour, so the delivery rates are raised by default (--global-rate / --per-chat-rate).
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+BENCH_TOKEN = "bench"
+SEED = 7
+
+def synthetic_users(n, seed=SEED):
+    """n ready users spread over every gender/category/size the size maps know"""
+    with open(os.path.join(REPO, "size_map.json"), encoding="utf-8") as f:
+        shoe_sizes = {g: list(sizes) for g, sizes in json.load(f).items()}
+    clothing_sizes = ["XS", "S", "M", "L", "XL", "XXL"]
+
+    rng = random.Random(seed)
+    users = {}
+    for i in range(n):
+        chat_id = 100000 + i
+        gender = rng.choice(("men", "women", "kids"))
+        category = rng.choice(("shoes", "clothing", "both"))
+        price_min = rng.choice((0, 100, 200, 300))
+        users[str(chat_id)] = {
+            "chat_id": chat_id,
+            "state": "ready",
+            "welcome_sent": True,
+            "gender": gender,
+            "category": category,
+            "shoes_size": rng.choice(shoe_sizes[gender]) if category in ("shoes", "both") else None,
+            "clothing_size": rng.choice(clothing_sizes) if category in ("clothing", "both") else None,
+            "price_min": price_min,
+            "price_max": price_min + rng.choice((200, 400, 800)),
+        }
+    return users
+
+class _Quiet(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; without this, Nagle plus
+        # delayed ACKs add ~40ms to every keep-alive response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+class SiteServer(ThreadingHTTPServer):
+    """Serves the recorded listing page for /men/..., /women/..., /kids/...; the coupon page elsewhere"""
+    daemon_threads = True
+
+    def __init__(self, listing_html, coupon_html):
+        self.listing_html = listing_html
+        self.coupon_html = coupon_html
+        self.lock = threading.Lock()
+        self.counts = {"listing": 0, "coupon": 0, "not_modified": 0}
+        super().__init__(("127.0.0.1", 0), self.Handler)
+
+    class Handler(_Quiet):
+        def do_GET(self):
+            server = self.server
+            kind = "listing" if self.path.split("/")[1] in ("men", "women", "kids") else "coupon"
+            body = server.listing_html if kind == "listing" else server.coupon_html
+            etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+            not_modified = self.headers.get("If-None-Match") == etag
+            with server.lock:
+                server.counts[kind] += 1
+                server.counts["not_modified"] += not_modified
+            if not_modified:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+            else:
+                self._send(200, body, "text/html; charset=utf-8", {"ETag": etag})
+
+class FakeTelegram(ThreadingHTTPServer):
+    """Records Bot API calls; every rate_limit_every-th call gets a 429"""
+    daemon_threads = True
+
+    def __init__(self, rate_limit_every=0, retry_after=1):
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.total = 0
+        self.rate_limited = 0
+        super().__init__(("127.0.0.1", 0), self.Handler)
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.total = 0
+            self.rate_limited = 0
+
+    class Handler(_Quiet):
+        def do_POST(self):
+            server = self.server
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            method = self.path.rsplit("/", 1)[-1]
+            with server.lock:
+                server.total += 1
+                limited = server.rate_limit_every and server.total % server.rate_limit_every == 0
+                if limited:
+                    server.rate_limited += 1
+                else:
+                    server.calls[method] = server.calls.get(method, 0) + 1
+
+            if limited:
+                body = json.dumps({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {server.retry_after}",
+                    "parameters": {"retry_after": server.retry_after},
+                }).encode()
+                self._send(429, body, "application/json", {"Retry-After": str(server.retry_after)})
+            else:
+                self._send(200, b'{"ok":true,"result":{}}', "application/json")
+
+        do_GET = do_POST
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_worker():
+    """Inside the checker subprocess: run main, then report wall time and peak RSS"""
+    import timberland_checker
+
+    started = time.perf_counter()
+    timberland_checker.main(["--profile"])
+    print(json.dumps({
+        "wall_s": round(time.perf_counter() - started, 3),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+def run_population(n, site_url, telegram, telegram_url, args):
+    """Run the checker args.runs times over one population's state; one result per run"""
+    workdir = tempfile.mkdtemp(prefix=f"bench_checker_{n}_")
+    results = []
+    try:
+        for name in ("size_map.json", "apparel_size_map.json"):
+            shutil.copy(os.path.join(REPO, name), workdir)
+        with open(os.path.join(workdir, "user_data.json"), "w", encoding="utf-8") as f:
+            json.dump(synthetic_users(n), f)
+
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPO,
+            TIMBERLAND_BASE_URL=site_url,
+            TELEGRAM_API_BASE=telegram_url,
+            TELEGRAM_BOT_TOKEN=BENCH_TOKEN,
+            COUPON_DYNAMIC_SOURCES=",".join(f"{site_url}/coupons/{i}" for i in range(3)),
+            GITHUB_EVENT_NAME="workflow_dispatch",  # bypass the send window
+            TELEGRAM_GLOBAL_RATE=str(args.global_rate),
+            TELEGRAM_PER_CHAT_RATE=str(args.per_chat_rate),
+            STORAGE_BACKEND=args.storage,
+            RUN_PROFILE_OUTPUT=os.path.join(workdir, "run_profile.json"),
+        )
+        for run in range(1, args.runs + 1):
+            telegram.reset()
+            before = dict(args.site.counts)
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker"],
+                cwd=workdir, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stdout[-4000:] + proc.stderr[-4000:])
+                raise SystemExit(f"checker run with {n} users failed")
+
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            with open(os.path.join(workdir, "run_profile.json"), encoding="utf-8") as f:
+                profile = json.load(f)
+            counters = profile.get("counters", {})
+            with telegram.lock:
+                result.update({
+                    "users": n,
+                    "run": run,
+                    "listing_fetches": args.site.counts["listing"] - before["listing"],
+                    "not_modified": args.site.counts["not_modified"] - before["not_modified"],
+                    "coupon_fetches": args.site.counts["coupon"] - before["coupon"],
+                    "listings_skipped": counters.get("diff.skipped", 0),
+                    "api_calls": sum(telegram.calls.values()),
+                    "api_calls_by_method": dict(sorted(telegram.calls.items())),
+                    "injected_429": telegram.rate_limited,
+                    "profile": profile,
+                })
+            results.append(result)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of timberland_checker")
+    parser.add_argument("listing", nargs="?")
+    parser.add_argument("--users", default="10,1000,10000", help="comma-separated population sizes")
+    parser.add_argument("--rate-limit-every", type=int, default=50, help="answer every Nth Telegram call with 429 (0 = never)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--global-rate", type=float, default=5000)
+    parser.add_argument("--per-chat-rate", type=float, default=100)
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--runs", type=int, default=1, help="checker runs per population over the same state")
+    parser.add_argument("--out-dir", default=".", help="where bench_checker_<users>.json reports go")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return
+
+    listing_path = args.listing or sorted(glob.glob(os.path.join(HERE, "fixtures", "listing_*.html")))[0]
+    coupon_path = sorted(glob.glob(os.path.join(HERE, "fixtures", "coupons_*.html")))[0]
+    with open(listing_path, "rb") as f, open(coupon_path, "rb") as g:
+        args.site = SiteServer(f.read(), g.read())
+    telegram = FakeTelegram(args.rate_limit_every, args.retry_after)
+    site_url = serve(args.site)
+    telegram_url = serve(telegram)
+
+    print(f"listing fixture: {listing_path}, 429 every {args.rate_limit_every} calls, "
+          f"storage {args.storage}\n")
+    print(f"{'users':>7}{'run':>5}{'wall s':>9}{'fetches':>9}{'304s':>6}{'skipped':>9}{'api calls':>11}"
+          f"{'429s':>7}{'peak RSS MB':>13}")
+    for n in (int(x) for x in args.users.split(",") if x.strip()):
+        results = run_population(n, site_url, telegram, telegram_url, args)
+        for r in results:
+            print(f"{n:>7}{r['run']:>5}{r['wall_s']:>9.2f}{r['listing_fetches']:>9}{r['not_modified']:>6}"
+                  f"{r['listings_skipped']:>9}{r['api_calls']:>11}{r['injected_429']:>7}{r['peak_rss_kb'] / 1024:>13.1f}")
+        with open(os.path.join(args.out_dir, f"bench_checker_{n}.json"), "w", encoding="utf-8") as f:
+            json.dump(results if len(results) > 1 else results[0], f, indent=2)
+
+if __name__ == "__main__":
+    main()
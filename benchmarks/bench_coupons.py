@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# bench_coupons.py - Micro-benchmark for coupon code extraction
+#
+# Usage: python benchmarks/bench_coupons.py [--repeat N] [coupons.html ...]
+# Defaults to every benchmarks/fixtures/coupons_*.html. Compares the original
+# three-pass extraction against the single precompiled pattern, with both the
+# BeautifulSoup ("dom") and regex ("fast") text extractors, and checks that all
+# of them find the same set of candidate codes.
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bs4 import BeautifulSoup
+
+from live_coupon_checker import COUPON_CODE_RE, NON_COUPON_WORDS, page_text
+
+def legacy_codes(html_text):
+    """The extraction as it was before the single-pass rewrite (without the top-5 cut)"""
+    text = BeautifulSoup(html_text, "html.parser").get_text()
+    patterns = [
+        r'\b[A-Z]{3,6}\d{1,3}\b',
+        r'\b[A-Z]{4,8}\b',
+        r'\b\d{1,2}%?\s*OFF\b',
+    ]
+    codes = set()
+    for pattern in patterns:
+        for match in re.findall(pattern, text.upper()):
+            if match not in NON_COUPON_WORDS and len(match) >= 3:
+                codes.add(match)
+    return codes
+
+def single_pass_codes(extractor):
+    def run(html_text):
+        text = page_text(html_text, extractor).upper()
+        return {m for m in COUPON_CODE_RE.findall(text) if m not in NON_COUPON_WORDS}
+    return run
+
+VARIANTS = [
+    ("legacy 3-pass", legacy_codes),
+    ("1-pass dom", single_pass_codes("dom")),
+    ("1-pass fast", single_pass_codes("fast")),
+]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(HERE, "fixtures", "coupons_*.html")))
+    if not paths:
+        raise SystemExit("No coupon page fixtures found")
+    pages = [open(p, encoding="utf-8").read() for p in paths]
+
+    print(f"{len(pages)} page(s), {sum(len(p) for p in pages) // 1024} KB, {args.repeat} repeats\n")
+    print(f"{'variant':<16}{'ms/page':>10}  same codes")
+
+    reference = None
+    mismatch = False
+    for name, fn in VARIANTS:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            found = [fn(html_text) for html_text in pages]
+        ms = (time.perf_counter() - started) * 1000 / (args.repeat * len(pages))
+        if reference is None:
+            reference = found
+        same = found == reference
+        mismatch = mismatch or not same
+        print(f"{name:<16}{ms:>10.3f}  {'yes' if same else 'NO'}")
+
+    if mismatch:
+        raise SystemExit("Variants disagree on the extracted codes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# bench_parsers.py - Parse time and peak memory of each listing parser backend
+#
+# Usage: python benchmarks/bench_parsers.py [--repeat N] [listing.html ...]
+# Defaults to every benchmarks/fixtures/listing_*.html. Each backend runs in its
+# own subprocess so the peak RSS it reports is not shared with other backends.
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from listing_parsers import BACKENDS, available_backends
+
+BASE_URL = "https://www.timberland.co.il/men/footwear"
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_worker(backend, paths, repeat):
+    pages = [open(p, encoding="utf-8").read() for p in paths]
+    parse = BACKENDS[backend]
+
+    parse(pages[0], BASE_URL)  # warm up imports outside the measurement
+    rss_before = peak_rss_kb()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    results = []
+    for _ in range(repeat):
+        results = [parse(html, BASE_URL) for html in pages]
+    elapsed = time.perf_counter() - started
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "backend": backend,
+        "ms_per_page": round(elapsed * 1000 / (repeat * len(pages)), 3),
+        "py_peak_kb": py_peak // 1024,
+        "rss_growth_kb": peak_rss_kb() - rss_before,
+        "items": results,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(HERE, "fixtures", "listing_*.html")))
+    if not paths:
+        raise SystemExit("No listing fixtures found")
+
+    if args.worker:
+        run_worker(args.worker, paths, args.repeat)
+        return
+
+    reports = []
+    for backend in available_backends():
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend, "--repeat", str(args.repeat), *paths],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        reports.append(json.loads(out.strip().splitlines()[-1]))
+
+    reference = reports[0]["items"]
+    print(f"{len(paths)} fixture(s), {sum(len(r) for r in reference)} items, {args.repeat} repeats\n")
+    print(f"{'backend':<12}{'ms/page':>10}{'py peak KB':>12}{'RSS +KB':>10}  identical")
+    for r in reports:
+        same = "yes" if r["items"] == reference else "NO"
+        print(f"{r['backend']:<12}{r['ms_per_page']:>10}{r['py_peak_kb']:>12}{r['rss_growth_kb']:>10}  {same}")
+
+    if any(r["items"] != reference for r in reports):
+        raise SystemExit("Backends disagree on the parsed items")
+
+if __name__ == "__main__":
+    main()
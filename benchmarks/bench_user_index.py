@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# bench_user_index.py - Matching scraped items to interested users: scan vs UserIndex
+#
+# Usage: python benchmarks/bench_user_index.py [--users 50000] [--repeat N] [listing.html]
+# Parses the recorded listing once, then for every (kind, gender, size) bucket
+# the synthetic population uses, matches each item against the users: first by
+# scanning every user (what check_price_alerts did), then with a UserIndex
+# lookup + bisect. Checks both produce the same matches.
+import argparse
+import glob
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_checker import synthetic_users
+from listing_parsers import parse_listing
+from smart_alerts import extract_price
+from user_index import UserIndex, user_buckets
+
+BASE_URL = "https://www.timberland.co.il/men/footwear"
+
+def scan_match(user_data, bucket, price):
+    """The O(users) loop: every ready user in the bucket with price_max >= price"""
+    return [
+        user_id for user_id, u in user_data.items()
+        if u.get("state") == "ready" and bucket in user_buckets(u) and price <= u.get("price_max", 999999)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("listing", nargs="?")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = args.listing or sorted(glob.glob(os.path.join(HERE, "fixtures", "listing_*.html")))[0]
+    with open(path, encoding="utf-8") as f:
+        items = parse_listing(f.read(), BASE_URL)
+    prices = [p for p in (extract_price(it.get("price", "")) for it in items) if p]
+
+    user_data = synthetic_users(args.users)
+    buckets = sorted({b for u in user_data.values() for b in user_buckets(u)})
+    lookups = len(buckets) * len(prices)
+    print(f"{args.users} users, {len(buckets)} buckets, {len(prices)} priced items -> {lookups} bucket/item lookups\n")
+
+    started = time.perf_counter()
+    index = UserIndex(user_data)
+    build_ms = (time.perf_counter() - started) * 1000
+    print(f"index build: {build_ms:.1f}ms {index.stats()}")
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        indexed = [index.match(b, p) for b in buckets for p in prices]
+    index_ms = (time.perf_counter() - started) * 1000 / args.repeat
+
+    # One scan pass is plenty to show the difference (and takes a while)
+    started = time.perf_counter()
+    scanned = [scan_match(user_data, b, p) for b in buckets for p in prices]
+    scan_ms = (time.perf_counter() - started) * 1000
+
+    matches = sum(len(m) for m in indexed)
+    print(f"\n{'method':<10}{'total ms':>12}{'us/lookup':>12}{'matches':>10}")
+    print(f"{'scan':<10}{scan_ms:>12.1f}{scan_ms * 1000 / lookups:>12.1f}{sum(len(m) for m in scanned):>10}")
+    print(f"{'index':<10}{index_ms:>12.1f}{index_ms * 1000 / lookups:>12.1f}{matches:>10}")
+    print(f"\nspeedup: {scan_ms / index_ms:.0f}x")
+
+    if any(sorted(a) != sorted(b) for a, b in zip(scanned, indexed)):
+        raise SystemExit("Index and scan disagree on the matched users")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# browser_pool.py - Shared headless browser with a bounded pool of contexts
+import os
+import time
+from urllib.parse import urlparse
+
+from run_profiler import profiler
+
+# One browser per run, handing out pages from a small pool of contexts.
+# A context is thrown away and rebuilt after BROWSER_RECYCLE_AFTER navigations
+# (keeps memory/cookies from piling up) or as soon as a navigation crashes it.
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_RECYCLE_AFTER = int(os.getenv("BROWSER_RECYCLE_AFTER", "25"))
+
+NAVIGATION_TIMEOUT_MS = 60000
+
+# A listing is ready as soon as a product tile (the selector scrape_products reads)
+# or Magento's "no products" notice is in the DOM, capped at READY_TIMEOUT_MS.
+READY_SELECTOR = "li.product-item, .product-item, .message.info.empty"
+READY_TIMEOUT_MS = int(os.getenv("READY_TIMEOUT_MS", "15000"))
+
+# Nothing we scrape needs these; dropping them saves most of the page weight.
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "facebook.com",
+    "hotjar.com",
+    "clarity.ms",
+    "tiktok.com",
+    "criteo.com",
+    "taboola.com",
+    "yotpo.com",
+)
+
+def log(msg: str):
+    print(msg)
+
+def latency_summary(samples):
+    """Summarize a list of latencies (seconds) as count/avg/p50/p95/max"""
+    if not samples:
+        return {"count": 0}
+
+    ordered = sorted(samples)
+    n = len(ordered)
+
+    def pct(p):
+        return ordered[min(n - 1, int(round(p * (n - 1))))]
+
+    return {
+        "count": n,
+        "avg": round(sum(ordered) / n, 3),
+        "p50": round(pct(0.50), 3),
+        "p95": round(pct(0.95), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+def should_block(resource_type: str, url: str):
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in BLOCKED_HOSTS)
+
+class _ContextSlot:
+    def __init__(self, context):
+        self.context = context
+        self.uses = 0
+
+class BrowserPool:
+    """Owns one Chromium instance for the whole run (sync Playwright API)"""
+
+    def __init__(self, playwright, size=BROWSER_POOL_SIZE, recycle_after=BROWSER_RECYCLE_AFTER):
+        self.playwright = playwright
+        self.size = max(1, int(size))
+        self.recycle_after = max(1, int(recycle_after))
+        self.browser = None
+        self.idle = []
+        self.open_slots = 0
+        self.launches = 0
+        self.recycled = 0
+        self.blocked_requests = 0
+        self.ready_timeouts = 0
+        self.fetch_times = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        if self.browser and self.browser.is_connected():
+            return
+        with profiler.stage("browser.launch"):
+            self.browser = self.playwright.chromium.launch(headless=True)
+        self.launches += 1
+        self.idle = []
+        self.open_slots = 0
+        log(f"Browser launched (pool size={self.size}, recycle after {self.recycle_after} navigations)")
+
+    def close(self):
+        for slot in self.idle:
+            self._close_context(slot)
+        self.idle = []
+        self.open_slots = 0
+        if self.browser:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+            self.browser = None
+
+    def _close_context(self, slot):
+        try:
+            slot.context.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        if not self.browser or not self.browser.is_connected():
+            log("Browser not connected, relaunching")
+            self.start()
+
+        if self.idle:
+            return self.idle.pop()
+
+        if self.open_slots >= self.size:
+            # The sync API only ever has one page in flight, so this means a slot
+            # was not released; fail loudly instead of silently growing the pool.
+            raise RuntimeError("Browser pool exhausted")
+
+        self.open_slots += 1
+        context = self.browser.new_context()
+        context.route("**/*", self._route)
+        return _ContextSlot(context)
+
+    def _route(self, route):
+        request = route.request
+        if should_block(request.resource_type, request.url):
+            self.blocked_requests += 1
+            route.abort()
+        else:
+            route.continue_()
+
+    def release(self, slot, crashed=False):
+        slot.uses += 1
+        if crashed or slot.uses >= self.recycle_after:
+            self._close_context(slot)
+            self.open_slots -= 1
+            self.recycled += 1
+            return
+        self.idle.append(slot)
+
+    def fetch(self, url: str):
+        """Navigate a pooled page to url and return its HTML"""
+        slot = self.acquire()
+        page = None
+        crashed = False
+        started = time.perf_counter()
+        try:
+            page = slot.context.new_page()
+            with profiler.stage("browser.goto"):
+                page.goto(url, wait_until="domcontentloaded", timeout=NAVIGATION_TIMEOUT_MS)
+            try:
+                with profiler.stage("browser.ready_wait"):
+                    page.wait_for_selector(READY_SELECTOR, state="attached", timeout=READY_TIMEOUT_MS)
+            except Exception:
+                # Not fatal: hand back whatever rendered, scrape_products copes with it
+                self.ready_timeouts += 1
+                log(f"Listing not ready after {READY_TIMEOUT_MS}ms: {url}")
+            with profiler.stage("browser.content"):
+                return page.content()
+        except Exception:
+            crashed = True
+            raise
+        finally:
+            if page:
+                try:
+                    page.close()
+                except Exception:
+                    crashed = True
+            elapsed = time.perf_counter() - started
+            self.fetch_times.append(elapsed)
+            log(f"fetch {elapsed:.2f}s {url}")
+            self.release(slot, crashed=crashed)
+
+    def stats(self):
+        return {
+            "launches": self.launches,
+            "recycled_contexts": self.recycled,
+            "blocked_requests": self.blocked_requests,
+            "ready_timeouts": self.ready_timeouts,
+            "fetch_latency": latency_summary(self.fetch_times),
+        }
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# http_fetcher.py - Plain-HTTP listing fetches on a pooled requests.Session
+#
+# Fetches can be conditional: given the ETag / Last-Modified a URL answered
+# with last time, a 304 comes back as not_modified with no body to parse.
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+HTTP_FETCH_WORKERS = int(os.getenv("HTTP_FETCH_WORKERS", "4"))
+HTTP_TIMEOUT_SECONDS = 20
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "he-IL,he;q=0.9,en;q=0.8",
+}
+
+_session = None
+
+def log(msg: str):
+    print(msg)
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session.headers.update(HEADERS)
+    return _session
+
+def fetch_static_result(url: str, validators=None):
+    """
+    GET url without a browser, conditionally when validators ({"etag",
+    "last_modified"} from a previous result) are given. Returns {"html",
+    "not_modified", "etag", "last_modified"}; html is "" on any failure.
+    """
+    result = {"html": "", "not_modified": False, "etag": None, "last_modified": None}
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    started = time.perf_counter()
+    try:
+        r = get_session().get(url, headers=headers, timeout=HTTP_TIMEOUT_SECONDS)
+        result["etag"] = r.headers.get("ETag")
+        result["last_modified"] = r.headers.get("Last-Modified")
+        if r.status_code == 304 and headers:
+            result["not_modified"] = True
+            return result
+        if r.status_code != 200:
+            log(f"http {r.status_code} {url}")
+            return result
+        if "charset" not in r.headers.get("Content-Type", "").lower():
+            # requests falls back to ISO-8859-1 for text/html; the site is UTF-8
+            r.encoding = "utf-8"
+        result["html"] = r.text
+        return result
+    except Exception as e:
+        log(f"http error {url}: {e}")
+        return result
+    finally:
+        log(f"http fetch {time.perf_counter() - started:.2f}s {url}")
+
+def fetch_static_many(urls, validators=None):
+    """
+    Fetch several URLs over the shared session in parallel. Returns url ->
+    fetch_static_result(); validators maps url -> its conditional headers' values.
+    """
+    urls = list(urls)
+    if not urls:
+        return {}
+    validators = validators or {}
+    with ThreadPoolExecutor(max_workers=max(1, HTTP_FETCH_WORKERS)) as executor:
+        return dict(zip(urls, executor.map(lambda url: fetch_static_result(url, validators.get(url)), urls)))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# listing_parsers.py - Interchangeable HTML backends for scraping product listings
+#
+# Every backend walks the same Magento markup and must return exactly the same
+# item dicts (id, title, price, link, img) as the original BeautifulSoup code:
+#   product:  li.product-item, else .product-item
+#   title:    first .product-item-link, else first <a>   (text joined, stripped)
+#   image:    first <img> data-src, else src
+#   price:    first .price, else .special-price, else [data-price-amount]
+import os
+
+PARSER_BACKEND = (os.getenv("PARSER_BACKEND") or "bs4").strip().lower()
+
+SITE_URL = "https://www.timberland.co.il"
+
+def _make_item(title, href, img, price_text, base_url):
+    if href and href.startswith("/"):
+        link = SITE_URL + href
+    elif href.startswith("http"):
+        link = href
+    else:
+        link = base_url
+
+    if img and img.startswith("//"):
+        img = "https:" + img
+
+    return {
+        "id": link,
+        "title": title,
+        "price": price_text,
+        "link": link,
+        "img": img,
+    }
+
+def _dedupe(items):
+    seen = set()
+    out = []
+    for it in items:
+        if it["id"] in seen:
+            continue
+        seen.add(it["id"])
+        out.append(it)
+    return out
+
+def parse_bs4(page_html: str, base_url: str):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page_html, "html.parser")
+    items = []
+
+    products = soup.select("li.product-item") or soup.select(".product-item")
+    for p in products:
+        title_el = p.select_one(".product-item-link") or p.select_one("a")
+        if not title_el:
+            continue
+        title = title_el.get_text(strip=True)
+        href = title_el.get("href") or ""
+
+        img_el = p.select_one("img")
+        img = ""
+        if img_el:
+            img = img_el.get("data-src") or img_el.get("src") or ""
+
+        price_el = p.select_one(".price") or p.select_one(".special-price") or p.select_one("[data-price-amount]")
+        price_text = price_el.get_text(" ", strip=True) if price_el else ""
+
+        items.append(_make_item(title, href, img, price_text, base_url))
+
+    return _dedupe(items)
+
+def _xpath_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_LX_PRODUCTS_LI = f"//li[{_xpath_class('product-item')}]"
+_LX_PRODUCTS_ANY = f"//*[{_xpath_class('product-item')}]"
+_LX_TITLE = f".//*[{_xpath_class('product-item-link')}]"
+_LX_PRICE = (
+    f".//*[{_xpath_class('price')}]",
+    f".//*[{_xpath_class('special-price')}]",
+    ".//*[@data-price-amount]",
+)
+
+def _lx_first(el, *paths):
+    for path in paths:
+        found = el.xpath(path)
+        if found:
+            return found[0]
+    return None
+
+def _lx_text(el, sep=""):
+    return sep.join(s.strip() for s in el.xpath(".//text()") if s.strip())
+
+def parse_lxml(page_html: str, base_url: str):
+    import lxml.etree
+    import lxml.html
+
+    if not page_html or not page_html.strip():
+        return []
+    try:
+        # Bytes, because lxml refuses a str that carries an XML encoding declaration
+        root = lxml.html.fromstring(page_html.encode("utf-8"), parser=lxml.html.HTMLParser(encoding="utf-8"))
+    except lxml.etree.ParserError:
+        return []  # nothing but comments/whitespace
+    items = []
+
+    products = root.xpath(_LX_PRODUCTS_LI) or root.xpath(_LX_PRODUCTS_ANY)
+    for p in products:
+        title_el = _lx_first(p, _LX_TITLE, ".//a")
+        if title_el is None:
+            continue
+        title = _lx_text(title_el)
+        href = title_el.get("href") or ""
+
+        img_el = _lx_first(p, ".//img")
+        img = ""
+        if img_el is not None:
+            img = img_el.get("data-src") or img_el.get("src") or ""
+
+        price_el = _lx_first(p, *_LX_PRICE)
+        price_text = _lx_text(price_el, " ") if price_el is not None else ""
+
+        items.append(_make_item(title, href, img, price_text, base_url))
+
+    return _dedupe(items)
+
+def parse_selectolax(page_html: str, base_url: str):
+    try:
+        from selectolax.lexbor import LexborHTMLParser as HTMLParser
+    except ImportError:  # selectolax < 0.3.12 only ships the Modest backend
+        from selectolax.parser import HTMLParser
+
+    tree = HTMLParser(page_html or "")
+    items = []
+
+    products = tree.css("li.product-item") or tree.css(".product-item")
+    for p in products:
+        title_el = p.css_first(".product-item-link") or p.css_first("a")
+        if title_el is None:
+            continue
+        title = title_el.text(deep=True, separator="", strip=True)
+        href = title_el.attributes.get("href") or ""
+
+        img_el = p.css_first("img")
+        img = ""
+        if img_el is not None:
+            img = img_el.attributes.get("data-src") or img_el.attributes.get("src") or ""
+
+        price_el = p.css_first(".price") or p.css_first(".special-price") or p.css_first("[data-price-amount]")
+        price_text = price_el.text(deep=True, separator=" ", strip=True) if price_el is not None else ""
+
+        items.append(_make_item(title, href, img, price_text, base_url))
+
+    return _dedupe(items)
+
+BACKENDS = {
+    "bs4": parse_bs4,
+    "lxml": parse_lxml,
+    "selectolax": parse_selectolax,
+}
+
+def available_backends():
+    """Backends whose parser library is importable here"""
+    modules = {"bs4": "bs4", "lxml": "lxml.html", "selectolax": "selectolax"}
+    out = []
+    for name, module in modules.items():
+        try:
+            __import__(module)
+            out.append(name)
+        except ImportError:
+            pass
+    return out
+
+def parse_listing(page_html: str, base_url: str, backend: str = PARSER_BACKEND):
+    parser = BACKENDS.get(backend)
+    if parser is None:
+        raise ValueError(f"Unknown parser backend: {backend}")
+    return parser(page_html, base_url)
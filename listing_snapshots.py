@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# listing_snapshots.py - Per-listing snapshots and the typed events between two scans
+#
+# For every listing URL we keep what it showed last run: the sorted 64-bit
+# product hashes plus each product's price, packed little-endian
+#   <n x uint64 hash><n x uint32 price (0 = unreadable)>
+# and a fingerprint of those bytes. Diffing a fresh listing against it is one
+# O(n) pass that yields config.EventType events:
+#   NEW_PRODUCT      on the listing now, not last run
+#   PRICE_DROP       on both, cheaper now
+#   REMOVED_PRODUCT  on the listing last run, gone now
+# A price rise is not an event, but like every price change it is listed in
+# ListingDiff.repriced so price history sees it. An unchanged listing has the
+# same fingerprint, so it costs the hashing of its items and nothing else.
+#
+# The first time a URL is seen there is nothing to compare with (baseline),
+# and an empty listing is treated as unknown - a failed fetch looks the same -
+# and leaves its snapshot alone.
+#
+# Each record also keeps what the page itself looked like when the snapshot
+# was taken: the ETag / Last-Modified it was served with and a hash of the
+# HTML. When a refetch answers 304, or with byte-identical HTML, the listing
+# has not changed and is not parsed at all; it becomes a "skipped" diff that
+# reuses the stored fingerprint and has no items or events.
+import base64
+import hashlib
+import struct
+from urllib.parse import urlsplit, urlunsplit
+
+from config import EventType
+from sent_items import item_hash
+from smart_alerts import extract_price
+from storage import get_store
+
+SNAPSHOT_META = "listing_snapshots"
+MAX_PRICE = 2 ** 32 - 1
+
+def product_key(url: str):
+    """Canonical product URL: no query/fragment/trailing slash, lower-case host"""
+    parts = urlsplit((url or "").strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), "", ""))
+
+def product_hash(url: str):
+    return item_hash(product_key(url))
+
+def _price(item):
+    price = extract_price(item.get("price", ""))
+    return min(price, MAX_PRICE) if price else 0
+
+def pack_listing(entries):
+    """{hash: price} -> (packed bytes, fingerprint hex)"""
+    hashes = sorted(entries)
+    raw = struct.pack(f"<{len(hashes)}Q", *hashes) + struct.pack(f"<{len(hashes)}I", *(entries[h] for h in hashes))
+    return raw, hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+def page_fingerprint(html: str):
+    return hashlib.blake2b(html.encode("utf-8"), digest_size=8).hexdigest()
+
+def unpack_listing(raw):
+    n = len(raw) // 12
+    hashes = struct.unpack_from(f"<{n}Q", raw, 0)
+    prices = struct.unpack_from(f"<{n}I", raw, 8 * n)
+    return dict(zip(hashes, prices))
+
+class ListingDiff:
+    """What changed on one listing since the last run"""
+
+    def __init__(self, url, items, fingerprint=None, previous_fingerprint=None, events=None, unknown=False,
+                 skipped=False):
+        self.url = url
+        self.items = items
+        self.fingerprint = fingerprint
+        self.previous_fingerprint = previous_fingerprint
+        self.events = events or []
+        self.unknown = unknown
+        self.skipped = skipped  # not refetched/parsed: items is empty, the stored fingerprint still holds
+        self.repriced = []  # (item, old_price, new_price) for every price change, rises included
+        self._changed = None
+        self._drops = None
+
+    @property
+    def baseline(self):
+        return self.previous_fingerprint is None and not (self.unknown or self.skipped)
+
+    @property
+    def unchanged(self):
+        return self.fingerprint is not None and self.fingerprint == self.previous_fingerprint
+
+    def of_type(self, event_type):
+        return [e for e in self.events if e["type"] == event_type]
+
+    def changed_items(self):
+        """
+        New and repriced items, in listing order (computed once, shared by all
+        users). Rises are included: with a union/no price filter in the URL, a
+        rise can move an item into a user's own band.
+        """
+        if self._changed is None:
+            ids = {e["product_id"] for e in self.of_type(EventType.NEW_PRODUCT)}
+            ids.update(it["id"] for it, _, _ in self.repriced)
+            self._changed = [it for it in self.items if it["id"] in ids]
+        return self._changed
+
+    def price_drops(self):
+        """product_id -> (old_price, new_price)"""
+        if self._drops is None:
+            self._drops = {e["product_id"]: (e["old_price"], e["price"]) for e in self.of_type(EventType.PRICE_DROP)}
+        return self._drops
+
+class ListingSnapshots:
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self.snapshots = self.store.get_meta(SNAPSHOT_META, {})  # url -> {"fp", "data", "etag", "last_modified", "page"}
+
+    def fingerprint(self, url):
+        record = self.snapshots.get(url)
+        return record["fp"] if record else None
+
+    def validators(self, url):
+        """What the page looked like when its snapshot was taken: {"etag", "last_modified", "page"}, or None"""
+        record = self.snapshots.get(url)
+        if not record:
+            return None
+        return {"etag": record.get("etag"), "last_modified": record.get("last_modified"), "page": record.get("page")}
+
+    def diff(self, url, items, page=None):
+        """
+        Compare a listing with its snapshot, emit events and take the new
+        snapshot. items None means the page is known to be unchanged (see
+        validators) and was not parsed. page: the validators of this fetch,
+        kept with the snapshot.
+        """
+        previous = self.snapshots.get(url)
+        previous_fingerprint = previous["fp"] if previous else None
+        if items is None:
+            return ListingDiff(url, [], previous_fingerprint, previous_fingerprint, skipped=True)
+
+        current = {}
+        by_hash = {}
+        for it in items:
+            h = product_hash(it["id"])
+            current[h] = _price(it)
+            by_hash[h] = it
+        if not current:
+            return ListingDiff(url, items, unknown=True)
+
+        raw, fingerprint = pack_listing(current)
+        diff = ListingDiff(url, items, fingerprint, previous_fingerprint)
+
+        record = dict(previous or {})
+        if page:
+            record.update(page)
+        if diff.unchanged:
+            self.snapshots[url] = record
+            return diff
+
+        record.update({"fp": diff.fingerprint, "data": base64.b64encode(raw).decode("ascii")})
+        self.snapshots[url] = record
+        if previous is None:
+            return diff
+
+        old = unpack_listing(base64.b64decode(previous["data"]))
+        for h, price in current.items():
+            item = by_hash[h]
+            if h not in old:
+                diff.events.append({"type": EventType.NEW_PRODUCT, "url": url, "hash": h, "product_id": item["id"],
+                                    "item": item, "price": price or None, "old_price": None})
+            elif price and old[h] and price != old[h]:
+                diff.repriced.append((item, old[h], price))
+                if price < old[h]:
+                    diff.events.append({"type": EventType.PRICE_DROP, "url": url, "hash": h, "product_id": item["id"],
+                                        "item": item, "price": price, "old_price": old[h]})
+        for h in old.keys() - current.keys():
+            diff.events.append({"type": EventType.REMOVED_PRODUCT, "url": url, "hash": h, "product_id": None,
+                                "item": None, "price": None, "old_price": old[h] or None})
+        return diff
+
+    def diff_all(self, listings, pages=None):
+        """url -> ListingDiff for every listing (url -> items, or None when not refetched)"""
+        pages = pages or {}
+        return {url: self.diff(url, items, pages.get(url)) for url, items in listings.items()}
+
+    def save(self, urls=None):
+        """Persist; with urls, snapshots of listings no longer scanned are dropped"""
+        if urls is not None:
+            self.snapshots = {url: s for url, s in self.snapshots.items() if url in urls}
+        return self.store.set_meta(SNAPSHOT_META, self.snapshots)
+
+def count_events(diffs):
+    counts = {"listings": len(diffs), "skipped": 0, "unchanged": 0, "baseline": 0, "unknown": 0,
+              EventType.NEW_PRODUCT: 0, EventType.PRICE_DROP: 0, EventType.REMOVED_PRODUCT: 0}
+    for diff in diffs.values():
+        counts["skipped"] += diff.skipped
+        counts["unchanged"] += diff.unchanged and not diff.skipped
+        counts["baseline"] += diff.baseline
+        counts["unknown"] += diff.unknown
+        for e in diff.events:
+            counts[e["type"]] += 1
+    return counts
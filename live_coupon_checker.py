@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 # live_coupon_checker.py - Live coupon validation
+import os
+import html
 import requests
 import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from bs4 import BeautifulSoup
 
+from storage import load_json, save_json
+
 # Known working coupon patterns for Timberland Israel
 COUPON_SOURCES = [
     {
@@ -21,54 +28,76 @@ COUPON_SOURCES = [
     }
 ]
 
-# Additional dynamic coupon sources
-DYNAMIC_SOURCES = [
+# Additional dynamic coupon sources (COUPON_DYNAMIC_SOURCES: comma-separated override)
+DYNAMIC_SOURCES = [u.strip() for u in os.getenv("COUPON_DYNAMIC_SOURCES", "").split(",") if u.strip()] or [
     "https://promocode.co.il/coupon-store/timberland/",
     "https://www.freecoupon.co.il/coupons/timberland/",
     "https://couponfollow.com/site/timberland.com"
 ]
 
-def extract_coupon_codes(html_text):
+# get_live_coupons() results are cached in memory and in COUPON_CACHE_FILE.
+# Fresh for COUPON_CACHE_TTL_SECONDS; after that the stale copy is still served
+# (up to COUPON_CACHE_MAX_STALE_SECONDS old) while one background refresh runs.
+COUPON_CACHE_FILE = "coupon_cache.json"
+COUPON_CACHE_TTL_SECONDS = int(os.getenv("COUPON_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+COUPON_CACHE_MAX_STALE_SECONDS = int(os.getenv("COUPON_CACHE_MAX_STALE_SECONDS", str(7 * 24 * 60 * 60)))
+
+_cache = None
+_cache_lock = threading.Lock()
+_refreshing = False
+
+# DYNAMIC_SOURCES are fetched in parallel, each with its own request timeout,
+# and the whole batch gives up after COUPON_FETCH_DEADLINE_SECONDS. A source
+# that fails SOURCE_FAILURE_THRESHOLD times in a row is skipped for
+# SOURCE_COOLDOWN_SECONDS. Breaker state and success/latency stats per source
+# are kept in COUPON_SOURCE_STATS_FILE across runs.
+COUPON_SOURCE_STATS_FILE = "coupon_sources.json"
+SOURCE_TIMEOUT_SECONDS = 10
+COUPON_FETCH_DEADLINE_SECONDS = float(os.getenv("COUPON_FETCH_DEADLINE_SECONDS", "12"))
+SOURCE_FAILURE_THRESHOLD = 3
+SOURCE_COOLDOWN_SECONDS = 6 * 60 * 60
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+
+# All three coupon shapes in one alternation, so the page text is scanned once:
+#   TIM12, SAVE10 ... | WELCOME, FIRST ... | 10% OFF, 15OFF ...
+# The alternatives cannot match overlapping spans, so this finds exactly what
+# three separate findall passes would.
+COUPON_CODE_RE = re.compile(r'\b[A-Z]{3,6}\d{1,3}\b|\b[A-Z]{4,8}\b|\b\d{1,2}%?\s*OFF\b')
+NON_COUPON_WORDS = frozenset({'TIMBERLAND', 'ISRAEL', 'COUPON', 'CODE', 'PROMO', 'DISCOUNT', 'SALE'})
+LIKELY_VALID_RE = re.compile(r'^(?:TIM|SAVE|MAX|FIRST|NEW|WELCOME)\d+$')
+
+# "dom" builds a BeautifulSoup tree for get_text(); "fast" strips markup with
+# regexes (dropping script/style/comments just like get_text does) and skips the DOM.
+COUPON_TEXT_EXTRACTOR = (os.getenv("COUPON_TEXT_EXTRACTOR") or "dom").strip().lower()
+_NON_TEXT_BLOCK_RE = re.compile(r'<(script|style|template)\b[^>]*>.*?</\1\s*>|<!--.*?-->', re.S | re.I)
+_TAG_RE = re.compile(r'</?[A-Za-z!?][^>]*>')
+
+def page_text(html_text, extractor=None):
+    """Visible text of an HTML page"""
+    if (extractor or COUPON_TEXT_EXTRACTOR) == "fast":
+        return html.unescape(_TAG_RE.sub("", _NON_TEXT_BLOCK_RE.sub("", html_text)))
+    return BeautifulSoup(html_text, "html.parser").get_text()
+
+def extract_coupon_codes(html_text, extractor=None):
     """Extract potential coupon codes from HTML"""
-    soup = BeautifulSoup(html_text, "html.parser")
-    text = soup.get_text()
-    
-    # Look for coupon patterns
-    patterns = [
-        r'\b[A-Z]{3,6}\d{1,3}\b',  # TIM12, SAVE10, etc.
-        r'\b[A-Z]{4,8}\b',         # WELCOME, FIRST, etc.
-        r'\b\d{1,2}%?\s*OFF\b',    # 10% OFF, 15OFF, etc.
-    ]
-    
-    codes = set()
-    for pattern in patterns:
-        matches = re.findall(pattern, text.upper())
-        for match in matches:
-            # Filter out common non-coupon words
-            if match not in {'TIMBERLAND', 'ISRAEL', 'COUPON', 'CODE', 'PROMO', 'DISCOUNT', 'SALE'}:
-                if len(match) >= 3:
-                    codes.add(match)
-    
-    return list(codes)[:5]  # Return max 5 codes
+    text = page_text(html_text, extractor).upper()
+
+    codes = {}
+    for match in COUPON_CODE_RE.findall(text):
+        # Filter out common non-coupon words
+        if match not in NON_COUPON_WORDS:
+            codes[match] = None
+
+    return list(codes)[:5]  # Return max 5 codes, in page order
 
 def validate_coupon_code(code):
     """Try to validate if a coupon code might work"""
     # This is a simulation - real validation would require API access
     # We'll use heuristics to determine likely valid codes
-    
-    valid_patterns = [
-        r'^TIM\d+$',      # TIM12, TIM15, etc.
-        r'^SAVE\d+$',     # SAVE10, SAVE20, etc.
-        r'^MAX\d+$',      # MAX7, MAX10, etc.
-        r'^FIRST\d+$',    # FIRST15, FIRST20, etc.
-        r'^NEW\d+$',      # NEW20, NEW25, etc.
-        r'^WELCOME\d+$',  # WELCOME10, etc.
-    ]
-    
-    for pattern in valid_patterns:
-        if re.match(pattern, code):
-            return True
-    
+    if LIKELY_VALID_RE.match(code):
+        return True
+
     # Additional checks for common coupon formats
     if len(code) >= 4 and len(code) <= 12:
         if any(char.isdigit() for char in code) and any(char.isalpha() for char in code):
@@ -76,6 +105,72 @@ def validate_coupon_code(code):
     
     return False
 
+def fetch_source(url):
+    """Fetch one coupon site. Returns its valid-looking codes; raises on failure"""
+    response = requests.get(url, headers=HEADERS, timeout=SOURCE_TIMEOUT_SECONDS)
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return [code for code in extract_coupon_codes(response.text) if validate_coupon_code(code)]
+
+def _source_open(stats, now):
+    return stats.get("open_until", 0) > now
+
+def _record_source(stats, ok, latency, now):
+    stats["attempts"] = stats.get("attempts", 0) + 1
+    stats["last_latency"] = round(latency, 3)
+    stats["total_latency"] = round(stats.get("total_latency", 0) + latency, 3)
+    if ok:
+        stats["successes"] = stats.get("successes", 0) + 1
+        stats["consecutive_failures"] = 0
+        stats.pop("open_until", None)
+    else:
+        stats["failures"] = stats.get("failures", 0) + 1
+        stats["consecutive_failures"] = stats.get("consecutive_failures", 0) + 1
+        if stats["consecutive_failures"] >= SOURCE_FAILURE_THRESHOLD:
+            stats["open_until"] = int(now + SOURCE_COOLDOWN_SECONDS)
+
+def _timed_fetch(url):
+    """(codes, latency, error) for one source; never raises"""
+    started = time.perf_counter()
+    try:
+        return fetch_source(url), time.perf_counter() - started, None
+    except Exception as e:
+        return [], time.perf_counter() - started, e
+
+def fetch_dynamic_codes(sources=None, deadline=None):
+    """Codes from every healthy dynamic source, fetched concurrently under one deadline"""
+    sources = DYNAMIC_SOURCES if sources is None else sources
+    deadline = COUPON_FETCH_DEADLINE_SECONDS if deadline is None else deadline
+    all_stats = load_json(COUPON_SOURCE_STATS_FILE, {})
+    now = time.time()
+
+    healthy = [url for url in sources if not _source_open(all_stats.get(url, {}), now)]
+    for url in sources:
+        if url not in healthy:
+            print(f"Coupon source skipped (circuit open): {url}")
+
+    codes = []
+    if healthy:
+        executor = ThreadPoolExecutor(max_workers=len(healthy))
+        futures = {executor.submit(_timed_fetch, url): url for url in healthy}
+        done, pending = wait(futures, timeout=deadline)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in done:
+            url = futures[future]
+            found, latency, error = future.result()
+            if error:
+                print(f"Coupon source failed after {latency:.2f}s: {url}: {error}")
+            codes.extend(found)
+            _record_source(all_stats.setdefault(url, {}), error is None, latency, now)
+
+        for future in pending:
+            print(f"Coupon source timed out after {deadline:.1f}s: {futures[future]}")
+            _record_source(all_stats.setdefault(futures[future], {}), False, deadline, now)
+
+    save_json(COUPON_SOURCE_STATS_FILE, all_stats)
+    return codes
+
 def get_live_coupons():
     """Get live coupon codes from various sources"""
     live_coupons = []
@@ -92,24 +187,14 @@ def get_live_coupons():
             })
     
     # Try to fetch from dynamic sources
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-    
-    for url in DYNAMIC_SOURCES:
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                codes = extract_coupon_codes(response.text)
-                for code in codes:
-                    if validate_coupon_code(code):
-                        live_coupons.append({
-                            "code": code,
-                            "description": "Found on coupon site - try at checkout",
-                            "source": "Dynamic",
-                            "confidence": "medium"
-                        })
-        except:
-            continue
-    
+    for code in fetch_dynamic_codes():
+        live_coupons.append({
+            "code": code,
+            "description": "Found on coupon site - try at checkout",
+            "source": "Dynamic",
+            "confidence": "medium"
+        })
+
     # Remove duplicates and sort by confidence
     seen_codes = set()
     unique_coupons = []
@@ -144,10 +229,64 @@ def format_coupon_message(coupons):
     message += "Try these codes at checkout on timberland.co.il"
     return message
 
+def _cache_age(cache, now):
+    if not cache or not isinstance(cache.get("fetched_at"), (int, float)):
+        return None
+    return now - cache["fetched_at"]
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        _cache = load_json(COUPON_CACHE_FILE, {})
+    return _cache
+
+def refresh_coupons():
+    """Fetch coupons now and store them in the memory and disk cache"""
+    global _cache
+    coupons = get_live_coupons()
+    with _cache_lock:
+        _cache = {"coupons": coupons, "fetched_at": int(time.time())}
+        save_json(COUPON_CACHE_FILE, _cache)
+    return coupons
+
+def _refresh_in_background():
+    global _refreshing
+    try:
+        refresh_coupons()
+    except Exception:
+        pass
+    finally:
+        _refreshing = False
+
+def get_cached_coupons():
+    """get_live_coupons() behind a TTL cache with stale-while-revalidate"""
+    global _refreshing
+    with _cache_lock:
+        cache = _load_cache()
+        age = _cache_age(cache, time.time())
+
+        if age is not None and age < COUPON_CACHE_TTL_SECONDS:
+            return cache["coupons"]
+
+        if age is not None and age < COUPON_CACHE_MAX_STALE_SECONDS:
+            if not _refreshing:
+                _refreshing = True
+                threading.Thread(target=_refresh_in_background, daemon=True).start()
+            return cache["coupons"]
+
+    return refresh_coupons()
+
+def prefetch_coupons():
+    """Warm the cache once before the user loop so every user gets the same answer"""
+    with _cache_lock:
+        age = _cache_age(_load_cache(), time.time())
+    if age is None or age >= COUPON_CACHE_TTL_SECONDS:
+        refresh_coupons()
+
 def get_formatted_coupons():
     """Main function to get formatted coupon message"""
     try:
-        coupons = get_live_coupons()
+        coupons = get_cached_coupons()
         return format_coupon_message(coupons)
     except Exception as e:
         return "💰 DISCOUNT COUPONS:\n\n📝 Unable to fetch coupons right now"
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# onboarding_webhook.py - Telegram webhook server for onboarding (alternative to polling)
+#
+# A small asyncio HTTP server: Telegram POSTs each update to WEBHOOK_PATH with
+# the X-Telegram-Bot-Api-Secret-Token header, we check it, run the update
+# through telegram_onboarding.handle_message and answer 200 straight away.
+# Replies go out through a DeliveryQueue, so handling never waits on Telegram,
+# and user_data is written in batches (every WEBHOOK_FLUSH_EVERY updates or
+# WEBHOOK_FLUSH_SECONDS) together with the last_update_id checkpoint.
+# Handling and flushing (fsync'd file / SQLite I/O) run on one store thread
+# that owns user_data, the writer and the store connection, so the event
+# loop only parses HTTP and never blocks on disk.
+#
+#   python onboarding_webhook.py serve [--set-webhook https://host/telegram/webhook] [--dry-run]
+#   python onboarding_webhook.py replay [updates.json] [--url http://127.0.0.1:8080/telegram/webhook]
+#
+# replay POSTs recorded updates (a list, or a saved getUpdates response) to a
+# running server and reports throughput; use it with serve --dry-run locally.
+# benchmarks/fixtures/updates_onboarding.json is a recorded sample: 24 users
+# onboarding (including malformed first tries, an edited message, /stock,
+# /stat and /reset) and one redelivered update.
+# Webhook and getUpdates polling are mutually exclusive on Telegram's side:
+# setting a webhook stops telegram_onboarding.py from receiving updates.
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import USERS_FLUSH_EVERY, USERS_FLUSH_SECONDS, UserDataWriter, get_store
+from telegram_client import TELEGRAM_BOT_TOKEN, get_client
+from telegram_delivery import DeliveryQueue
+from telegram_onboarding import checkpoint, load_checkpoint, process_updates
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_FLUSH_EVERY = int(os.getenv("WEBHOOK_FLUSH_EVERY", str(USERS_FLUSH_EVERY)))
+WEBHOOK_FLUSH_SECONDS = float(os.getenv("WEBHOOK_FLUSH_SECONDS", str(USERS_FLUSH_SECONDS)))
+WEBHOOK_MAX_CONNECTIONS = 100  # what we ask Telegram for in setWebhook
+
+MAX_BODY_BYTES = 1024 * 1024
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+SEEN_UPDATES_MAX = 10000
+REPLAY_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "updates_onboarding.json")
+FLUSH_POLL_SECONDS = 0.5
+
+def log(msg: str):
+    print(msg)
+
+class WebhookServer:
+    def __init__(self, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH, send=None, store=None,
+                 flush_every=WEBHOOK_FLUSH_EVERY, flush_seconds=WEBHOOK_FLUSH_SECONDS):
+        self.secret = secret
+        self.path = path
+        self.send = send
+        self.store = store
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="webhook-store")
+
+        self.user_data = None
+        self.writer = None
+        self.last_update_id = 0
+        # Updates arrive over several connections, so ids are not strictly
+        # increasing; remember recent ones instead of comparing to the max
+        self.seen_ids = set()
+        self.seen_order = deque()
+        self.stats = {"requests": 0, "updates": 0, "duplicates": 0, "rejected": 0}
+
+    def open(self):
+        """Load users and the checkpoint; runs on the store thread, which then owns the store"""
+        self.store = self.store or get_store()
+        self.user_data = self.store.load_users()
+        self.writer = UserDataWriter(self.user_data, self.store, self.flush_every, self.flush_seconds)
+        self.last_update_id, _ = load_checkpoint(self.store)
+
+    async def _on_store_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def authorized(self, headers):
+        if not self.secret:
+            return True
+        return hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret)
+
+    def handle_update(self, update):
+        """Process one update (on the store thread); Telegram redelivers on non-2xx, so skip ones already seen"""
+        update_id = update.get("update_id")
+        if isinstance(update_id, int):
+            if update_id in self.seen_ids:
+                self.stats["duplicates"] += 1
+                return
+            self.seen_ids.add(update_id)
+            self.seen_order.append(update_id)
+            if len(self.seen_order) > SEEN_UPDATES_MAX:
+                self.seen_ids.discard(self.seen_order.popleft())
+
+        max_id, _ = process_updates([update], self.user_data, fresh_start=False, send=self.send, writer=self.writer)
+        self.last_update_id = max(self.last_update_id, max_id)
+        checkpoint(self.writer, self.last_update_id)
+        self.stats["updates"] += 1
+        self.writer.maybe_flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.writer.seconds_until_due() or FLUSH_POLL_SECONDS)
+            await self._on_store_thread(self.writer.maybe_flush)
+
+    async def _respond(self, writer, status, reason, keep_alive):
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("ascii")
+        )
+        await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, version = (lines[0].split(" ") + ["", "", ""])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # No way to tell where the body ends, so the connection cannot be reused
+                    await self._respond(writer, 400, "Bad Request", False)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, "Payload Too Large", False)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                self.stats["requests"] += 1
+
+                if method != "POST" or target.split("?", 1)[0] != self.path:
+                    await self._respond(writer, 404, "Not Found", keep_alive)
+                elif not self.authorized(headers):
+                    self.stats["rejected"] += 1
+                    await self._respond(writer, 401, "Unauthorized", keep_alive)
+                else:
+                    try:
+                        update = json.loads(body)
+                    except ValueError:
+                        await self._respond(writer, 400, "Bad Request", keep_alive)
+                    else:
+                        try:
+                            await self._on_store_thread(self.handle_update, update)
+                        except Exception as e:
+                            # Still 200: a redelivered bad update would fail the same way
+                            log(f"Update {update.get('update_id')} failed: {e}")
+                        await self._respond(writer, 200, "OK", keep_alive)
+
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        """Serve until SIGTERM/SIGINT, then write out whatever is still dirty"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        await self._on_store_thread(self.open)
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        flusher = asyncio.create_task(self._flush_loop())
+        log(f"Webhook listening on http://{host}:{port}{self.path} "
+            f"({len(self.user_data)} users, last_update_id {self.last_update_id})")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            flusher.cancel()
+            await self._on_store_thread(self.writer.close)
+            self.executor.shutdown()
+            log(f"Webhook stats: {self.stats}, user writes: {self.writer.stats}")
+
+def set_webhook(url, secret=WEBHOOK_SECRET):
+    payload = {
+        "url": url,
+        "max_connections": WEBHOOK_MAX_CONNECTIONS,
+        "allowed_updates": json.dumps(["message", "edited_message"]),
+    }
+    if secret:
+        payload["secret_token"] = secret
+    result = get_client().call("setWebhook", payload)
+    if not result.ok:
+        raise SystemExit(f"setWebhook failed: {result.data or result.error}")
+    log(f"Webhook set to {url}")
+
+def load_recorded_updates(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("result", [])
+    return data
+
+async def replay(path, url, secret=WEBHOOK_SECRET, concurrency=50):
+    """POST recorded updates to a running server, like Telegram would, and time it"""
+    from urllib.parse import urlsplit
+
+    updates = load_recorded_updates(path)
+    parts = urlsplit(url)
+    port = parts.port or 80
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+    statuses = {}
+
+    async def worker():
+        reader, writer = await asyncio.open_connection(parts.hostname, port)
+        try:
+            while not queue.empty():
+                body = json.dumps(queue.get_nowait()).encode("utf-8")
+                request = (
+                    f"POST {parts.path or '/'} HTTP/1.1\r\nHost: {parts.hostname}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                    + (f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n" if secret else "")
+                    + "\r\n"
+                )
+                writer.write(request.encode("ascii") + body)
+                await writer.drain()
+                head = await reader.readuntil(b"\r\n\r\n")
+                status = head.split(b" ", 2)[1].decode()
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(updates)) or 1)))
+    elapsed = time.perf_counter() - started
+    log(f"Replayed {len(updates)} updates in {elapsed:.2f}s "
+        f"({len(updates) / elapsed if elapsed else 0:.0f}/s), statuses: {statuses}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Telegram onboarding webhook server")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_p = sub.add_parser("serve")
+    serve_p.add_argument("--host", default=WEBHOOK_HOST)
+    serve_p.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    serve_p.add_argument("--set-webhook", metavar="PUBLIC_URL", help="register this URL with Telegram first")
+    serve_p.add_argument("--dry-run", action="store_true", help="log replies instead of sending them")
+
+    replay_p = sub.add_parser("replay")
+    replay_p.add_argument("path", nargs="?", default=REPLAY_FIXTURE,
+                          help="JSON list of updates, or a saved getUpdates response (default: the recorded sample)")
+    replay_p.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    replay_p.add_argument("--concurrency", type=int, default=50)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "replay":
+        asyncio.run(replay(args.path, args.url, concurrency=args.concurrency))
+        return
+
+    if args.dry_run:
+        server = WebhookServer(send=lambda chat_id, text: None)
+        asyncio.run(server.serve(args.host, args.port))
+        return
+
+    if not TELEGRAM_BOT_TOKEN:
+        raise SystemExit("Missing TELEGRAM_BOT_TOKEN in GitHub Secrets.")
+    if not WEBHOOK_SECRET:
+        # Without it anyone who finds the URL can post forged updates
+        raise SystemExit("Missing WEBHOOK_SECRET (only --dry-run may serve unauthenticated).")
+    if args.set_webhook:
+        set_webhook(args.set_webhook)
+
+    with DeliveryQueue() as delivery:
+        server = WebhookServer(send=delivery.send_message)
+        asyncio.run(server.serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
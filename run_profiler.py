@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# run_profiler.py - Per-stage counters and latency histograms for a scan run
+#
+# Code wraps the interesting work in profiler.stage("name"); when the
+# profiler is off (the default) that is a shared no-op. With --profile (or
+# RUN_PROFILE=1) every stage records count, errors, total/min/max and a
+# latency histogram, and the run ends with a JSON summary in PROFILE_OUTPUT.
+# --cprofile additionally dumps cProfile stats (view with
+#   python -m pstats run_profile.prof
+# or snakeviz), at the cost of slowing the run down.
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+PROFILE_ENABLED = os.getenv("RUN_PROFILE", "").strip() in ("1", "true", "yes")
+PROFILE_OUTPUT = os.getenv("RUN_PROFILE_OUTPUT", "run_profile.json")
+CPROFILE_OUTPUT = os.getenv("RUN_CPROFILE_OUTPUT", "run_profile.prof")
+
+# Upper bounds in ms; the last bucket catches everything slower
+HISTOGRAM_BOUNDS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+def log(msg: str):
+    print(msg)
+
+class _Stage:
+    __slots__ = ("count", "errors", "total_ms", "min_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, ms, error=False):
+        self.count += 1
+        self.errors += error
+        self.total_ms += ms
+        self.min_ms = ms if self.min_ms is None else min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+        for i, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (None if past the last bound)"""
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else None
+        return None
+
+    def to_dict(self):
+        histogram = {f"<={b}ms": n for b, n in zip(HISTOGRAM_BOUNDS_MS, self.buckets) if n}
+        if self.buckets[-1]:
+            histogram[f">{HISTOGRAM_BOUNDS_MS[-1]}ms"] = self.buckets[-1]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 1),
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+            "min_ms": round(self.min_ms or 0, 2),
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms_le": self.percentile(0.5),
+            "p95_ms_le": self.percentile(0.95),
+            "histogram": histogram,
+        }
+
+_NOOP = contextlib.nullcontext()
+
+class RunProfiler:
+    def __init__(self, enabled=PROFILE_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.cprofile = None
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        self.started = time.perf_counter()
+        if cprofile and self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stage(self, name):
+        """Context manager timing one occurrence of a stage (no-op when disabled)"""
+        if not self.enabled:
+            return _NOOP
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, error)
+
+    def record(self, name, ms, error=False):
+        if not self.enabled:
+            return
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = _Stage()
+            stage.add(ms, error)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        with self.lock:
+            return {
+                "wall_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                "stages": {name: s.to_dict() for name, s in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def report(self, path=PROFILE_OUTPUT, cprofile_path=CPROFILE_OUTPUT):
+        """Write the JSON summary (and cProfile dump) and log a one-line-per-stage table"""
+        if not self.enabled:
+            return None
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(cprofile_path)
+            log(f"cProfile stats written to {cprofile_path}")
+
+        summary = self.summary()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        log(f"Run profile ({summary['wall_ms'] / 1000:.1f}s wall) written to {path}")
+        for name, s in summary["stages"].items():
+            log(f"  {name:<28}{s['count']:>6}x {s['total_ms']:>10.0f}ms total {s['avg_ms']:>9.1f}ms avg "
+                f"{s['max_ms']:>9.0f}ms max")
+        for name, n in summary["counters"].items():
+            log(f"  {name:<28}{n:>6}")
+        return summary
+
+profiler = RunProfiler()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# sent_items.py - Compact, expiring record of which products each user was sent
+#
+# Per user we keep a 64-bit hash of each product id plus the day it was sent,
+# packed little-endian and base64-encoded in the state file:
+#   {"sent": "<b64 of n x uint64 hashes + n x uint16 days>"}
+# That is ~14 bytes per product instead of a full product URL. Entries older
+# than SENT_ITEMS_TTL_DAYS are dropped so an item can be alerted again, and
+# each user keeps at most SENT_ITEMS_MAX entries (oldest go first).
+#
+# The old {"sent_ids": [url, ...]} format is read transparently; running
+#   python sent_items.py migrate
+# rewrites every user in the new format, and
+#   python sent_items.py report
+# prints entry counts and stored/in-memory sizes.
+import base64
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+
+SENT_ITEMS_TTL_DAYS = int(os.getenv("SENT_ITEMS_TTL_DAYS", "90"))
+SENT_ITEMS_MAX = int(os.getenv("SENT_ITEMS_MAX", "5000"))
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+def item_hash(product_id: str):
+    return int.from_bytes(hashlib.blake2b(product_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+def today(now=None):
+    return int((now if now is not None else time.time()) // SECONDS_PER_DAY)
+
+class SentItems:
+    def __init__(self, entries=None):
+        self.entries = entries or {}  # hash -> day sent
+
+    @classmethod
+    def from_state(cls, state, now=None):
+        """Build from a user's stored state, new or legacy format"""
+        state = state or {}
+        entries = {}
+
+        packed = state.get("sent")
+        if packed:
+            raw = base64.b64decode(packed)
+            n = len(raw) // 10
+            hashes = struct.unpack_from(f"<{n}Q", raw, 0)
+            days = struct.unpack_from(f"<{n}H", raw, 8 * n)
+            entries = dict(zip(hashes, days))
+
+        # Legacy list of product URLs: treat them as sent today so nothing is
+        # re-alerted straight after the migration.
+        day = today(now)
+        for product_id in state.get("sent_ids", []):
+            entries.setdefault(item_hash(product_id), day)
+
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def contains(self, product_id: str):
+        return item_hash(product_id) in self.entries
+
+    def add(self, product_id: str, now=None):
+        self.entries[item_hash(product_id)] = today(now)
+
+    def expiring(self, now=None, ttl_days=SENT_ITEMS_TTL_DAYS, max_items=SENT_ITEMS_MAX):
+        """How many entries expire() would drop, without dropping them"""
+        cutoff = today(now) - ttl_days
+        kept = sum(1 for d in self.entries.values() if d > cutoff)
+        return len(self.entries) - min(kept, max_items)
+
+    def expire(self, now=None, ttl_days=SENT_ITEMS_TTL_DAYS, max_items=SENT_ITEMS_MAX):
+        """Drop entries past their TTL, then the oldest beyond max_items. Returns count dropped"""
+        before = len(self.entries)
+        cutoff = today(now) - ttl_days
+        kept = [(h, d) for h, d in self.entries.items() if d > cutoff]
+        if len(kept) > max_items:
+            kept.sort(key=lambda e: e[1])
+            kept = kept[-max_items:]
+        self.entries = dict(kept)
+        return before - len(self.entries)
+
+    def to_state(self):
+        hashes = list(self.entries.keys())
+        days = [self.entries[h] for h in hashes]
+        n = len(hashes)
+        raw = struct.pack(f"<{n}Q", *hashes) + struct.pack(f"<{n}H", *days)
+        return {"sent": base64.b64encode(raw).decode("ascii")}
+
+    def memory_bytes(self):
+        """Rough in-memory footprint of the index"""
+        return sys.getsizeof(self.entries) + sum(sys.getsizeof(h) + sys.getsizeof(d) for h, d in self.entries.items())
+
+def count_entries(global_state: dict):
+    return sum(len(SentItems.from_state(s)) for s in global_state.values())
+
+def size_report(global_state: dict):
+    """Compare the stored size of the state as-is against the compact format"""
+    users = entries = memory = 0
+    compact = {}
+    for user_id, state in global_state.items():
+        sent = SentItems.from_state(state)
+        users += 1
+        entries += len(sent)
+        memory += sent.memory_bytes()
+        compact[user_id] = sent.to_state()
+
+    current_bytes = len(json.dumps(global_state, ensure_ascii=False, indent=2).encode("utf-8"))
+    compact_bytes = len(json.dumps(compact, ensure_ascii=False, indent=2).encode("utf-8"))
+    return {
+        "users": users,
+        "entries": entries,
+        "stored_bytes": current_bytes,
+        "compact_bytes": compact_bytes,
+        "in_memory_bytes": memory,
+    }
+
+def main(argv=None):
+    import argparse
+
+    from storage import get_store
+
+    parser = argparse.ArgumentParser(description="Sent-items state tools")
+    parser.add_argument("command", choices=("migrate", "report"))
+    args = parser.parse_args(argv)
+
+    store = get_store()
+    global_state = store.load_sent_state()
+    report = size_report(global_state)
+
+    if args.command == "migrate":
+        store.save_sent_state({uid: SentItems.from_state(s).to_state() for uid, s in global_state.items()})
+        print(f"Migrated {report['users']} users ({report['entries']} entries): "
+              f"{report['stored_bytes']} -> {report['compact_bytes']} bytes")
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,38 +1,15 @@
 #!/usr/bin/env python3
 # smart_alerts.py - Smart alerts system
-import json
-import os
 import time
-import requests
 import re
 from datetime import datetime
 
-PRICE_HISTORY_FILE = "price_history.json"
-STOCK_ALERTS_FILE = "stock_alerts.json"
-USER_DATA_FILE = "user_data.json"
-
-TELEGRAM_BOT_TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN") or "").strip()
-API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
-
-def load_json(path, default):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return default
-
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+from storage import get_store
+from telegram_client import get_client
+from user_index import UserIndex
 
 def send_message(chat_id, text):
-    url = f"{API}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-    try:
-        r = requests.post(url, data=payload, timeout=30)
-        return r.status_code == 200
-    except:
-        return False
+    return get_client().send_message(chat_id, text, disable_web_page_preview=False).ok
 
 def extract_price(price_text):
     """Extract numeric price from text like '299 ₪' or '₪299'"""
@@ -45,43 +22,104 @@ def extract_price(price_text):
         return int(numbers[0])
     return None
 
+class PriceHistoryStore:
+    """
+    In-memory view of the price history for one run.
+    Products are loaded from storage on first use, updated in place and
+    written back together by flush().
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.dirty = set()
+        self.recorded_this_run = {}
+
+    def get(self, product_id):
+        if product_id not in self.products:
+            self.products[product_id] = get_store().load_price_product(product_id)
+        return self.products[product_id]
+
+    def record(self, product_id, current_price, title=""):
+        # Several users can be sent the same product in one run; only the first
+        # sighting at a given price becomes a data point, so previous_lowest keeps
+        # meaning "before this run" for everyone.
+        if self.recorded_this_run.get(product_id) == current_price:
+            return self.get(product_id)
+
+        now = int(time.time())
+        product = self.get(product_id)
+
+        if product is None:
+            product = self.products[product_id] = {
+                "title": title,
+                "prices": [],
+                "lowest_price": current_price,
+                "highest_price": current_price,
+                "previous_lowest": current_price
+            }
+
+        # Store previous lowest for comparison
+        product["previous_lowest"] = product["lowest_price"]
+
+        # Add current price
+        product["prices"].append({"price": current_price, "timestamp": now})
+
+        # Keep only last 30 price points
+        product["prices"] = product["prices"][-30:]
+
+        # Update min/max
+        if current_price < product["lowest_price"]:
+            product["lowest_price"] = current_price
+        if current_price > product["highest_price"]:
+            product["highest_price"] = current_price
+
+        self.recorded_this_run[product_id] = current_price
+        self.dirty.add(product_id)
+        return product
+
+    def flush(self):
+        if self.dirty:
+            get_store().save_price_history({pid: self.products[pid] for pid in self.dirty})
+            self.dirty = set()
+
+_price_history = PriceHistoryStore()
+
 def update_price_history(product_id, current_price, title=""):
-    """Track price changes for products"""
-    history = load_json(PRICE_HISTORY_FILE, {})
-    now = int(time.time())
-    
-    if product_id not in history:
-        history[product_id] = {
-            "title": title,
-            "prices": [],
-            "lowest_price": current_price,
-            "highest_price": current_price,
-            "previous_lowest": current_price
-        }
-    
-    product = history[product_id]
-    
-    # Store previous lowest for comparison
-    product["previous_lowest"] = product["lowest_price"]
-    
-    # Add current price
-    product["prices"].append({"price": current_price, "timestamp": now})
-    
-    # Keep only last 30 price points
-    product["prices"] = product["prices"][-30:]
-    
-    # Update min/max
-    if current_price < product["lowest_price"]:
-        product["lowest_price"] = current_price
-    if current_price > product["highest_price"]:
-        product["highest_price"] = current_price
-    
-    save_json(PRICE_HISTORY_FILE, history)
-    return product
+    """Track price changes for products (call flush_price_history() to persist)"""
+    return _price_history.record(product_id, current_price, title)
+
+def record_listing_prices(diffs):
+    """
+    Update price history once per listing instead of once per user send:
+    every item of a listing seen for the first time, then only its new
+    products and the items whose price changed, up or down. diffs: url -> ListingDiff.
+    """
+    recorded = 0
+    for diff in diffs.values():
+        for it in (diff.items if diff.baseline else diff.changed_items()):
+            price = extract_price(it.get("price", ""))
+            if price:
+                _price_history.record(it["id"], price, it.get("title", ""))
+                recorded += 1
+    return recorded
 
-def check_price_alerts(items, user_data):
-    """Check if any prices dropped below user thresholds"""
+def get_price_product(product_id):
+    """A product's price history record (lowest/highest/previous_lowest/prices), or None"""
+    return _price_history.get(product_id)
+
+def flush_price_history():
+    """Write the run's price history changes to disk"""
+    _price_history.flush()
+
+def check_price_alerts(items, user_data, bucket=None, index=None):
+    """
+    Check if any prices dropped below user thresholds. bucket is the
+    (kind, gender, size) listing the items came from; None matches every
+    ready user. Pass a prebuilt UserIndex when calling for several listings.
+    """
     alerts_sent = []
+    if index is None:
+        index = UserIndex(user_data)
     
     for item in items:
         current_price = extract_price(item.get("price", ""))
@@ -93,68 +131,57 @@ def check_price_alerts(items, user_data):
         # Update price history
         product_history = update_price_history(product_id, current_price, item.get("title", ""))
         
-        # Check alerts for each user
-        for user_id, user in user_data.items():
-            if user.get("state") != "ready":
-                continue
-                
-            chat_id = user.get("chat_id")
-            user_max_price = user.get("price_max", 999999)
-            
-            # Price drop alert
-            if current_price <= user_max_price:
-                lowest_ever = product_history["lowest_price"]
-                
-                alert_text = f"🔥 PRICE ALERT!\n\n"
-                alert_text += f"📦 {item['title']}\n"
-                alert_text += f"💰 Current: {current_price}₪\n"
-                
-                if current_price == lowest_ever:
-                    alert_text += f"🎯 LOWEST PRICE EVER!\n"
-                else:
-                    alert_text += f"📊 Lowest ever: {lowest_ever}₪\n"
-                
-                alert_text += f"🔗 {item['link']}\n\n"
-                alert_text += f"💡 Share with friend: /share_{product_id.split('/')[-1][:10]}"
-                
-                if send_message(chat_id, alert_text):
-                    alerts_sent.append(f"Price alert sent to {user_id}")
-    
-    return alerts_sent
+        # Only users whose price_max is at least the current price
+        matched = index.match(bucket, current_price)
+        if not matched:
+            continue
 
-def check_stock_alerts():
-    """Check for items back in stock"""
-    stock_alerts = load_json(STOCK_ALERTS_FILE, {})
-    user_data = load_json(USER_DATA_FILE, {})
-    
-    alerts_sent = []
+        # The alert is the same for every matched user
+        lowest_ever = product_history["lowest_price"]
+
+        alert_text = f"🔥 PRICE ALERT!\n\n"
+        alert_text += f"📦 {item['title']}\n"
+        alert_text += f"💰 Current: {current_price}₪\n"
+
+        if current_price == lowest_ever:
+            alert_text += f"🎯 LOWEST PRICE EVER!\n"
+        else:
+            alert_text += f"📊 Lowest ever: {lowest_ever}₪\n"
+
+        alert_text += f"🔗 {item['link']}\n\n"
+        alert_text += f"💡 Share with friend: /share_{product_id.split('/')[-1][:10]}"
+
+        for user_id in matched:
+            if send_message(user_data[user_id].get("chat_id"), alert_text):
+                alerts_sent.append(f"Price alert sent to {user_id}")
     
-    # This would be called when scanning products
-    # For now, just return empty list
     return alerts_sent
 
+def check_stock_alerts(diffs=None, url_buckets=None, user_data=None, delivery=None):
+    """
+    Check for items back in stock: match the NEW_PRODUCT events of each
+    listing diff (url -> ListingDiff) to subscribers and alert them through
+    delivery. See stock_tracker for the details.
+    """
+    if not diffs or delivery is None:
+        return []
+
+    from stock_tracker import process_stock_alerts
+
+    alerted = process_stock_alerts(diffs, url_buckets or {}, user_data or {}, delivery)
+    return [f"Stock alert sent to {user_id}" for user_id in alerted]
+
 def add_stock_alert(user_id, product_url, size):
     """Add user to stock alert list for specific product/size"""
-    stock_alerts = load_json(STOCK_ALERTS_FILE, {})
-    
-    alert_key = f"{product_url}_{size}"
-    
-    if alert_key not in stock_alerts:
-        stock_alerts[alert_key] = []
-    
-    if user_id not in stock_alerts[alert_key]:
-        stock_alerts[alert_key].append(user_id)
-    
-    save_json(STOCK_ALERTS_FILE, stock_alerts)
+    return get_store().add_stock_alert(product_url, size, user_id)
 
 def get_price_history_summary(product_id):
     """Get price history summary for a product"""
-    history = load_json(PRICE_HISTORY_FILE, {})
-    
-    if product_id not in history:
+    product = _price_history.get(product_id)
+
+    if product is None:
         return "No price history available"
-    
-    product = history[product_id]
+
     lowest = product["lowest_price"]
     highest = product["highest_price"]
     
@@ -180,8 +207,8 @@ def generate_share_link(product_id, title, price, url):
     
     return share_text
 
-def process_smart_alerts(items, user_data):
-    """Main function to process all smart alerts"""
+def process_smart_alerts(items, user_data, bucket=None, index=None):
+    """Main function to process all smart alerts (index: a prebuilt UserIndex, see check_price_alerts)"""
     results = {
         "price_alerts": [],
         "stock_alerts": [],
@@ -189,9 +216,10 @@ def process_smart_alerts(items, user_data):
     }
     
     # Check price alerts
-    results["price_alerts"] = check_price_alerts(items, user_data)
+    results["price_alerts"] = check_price_alerts(items, user_data, bucket, index)
     
     # Check stock alerts
     results["stock_alerts"] = check_stock_alerts()
-    
+
+    flush_price_history()
     return results
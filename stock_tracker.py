@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# stock_tracker.py - Back-in-stock alerts from listing snapshot events
+#
+# Every listing URL we scan is filtered to one (kind, gender, size) bucket, so
+# a product on it is in stock in that size. The scan diffs each listing once
+# against its snapshot (see listing_snapshots); here NEW_PRODUCT events mean
+# the product is (back) in stock in that size, REMOVED_PRODUCT that it went
+# out of stock.
+#
+# Subscribers are found through StockIndex, product hash -> size -> set of
+# user ids, built once per run from the store. Each user gets one message
+# listing everything that came back for them, and the subscriptions that were
+# alerted are removed in one batch (an alert fires once; /stock again to
+# re-subscribe).
+#
+# A first-seen or empty listing has no events (an empty one looks like a
+# failed fetch), so a bad fetch never turns into a flood of back-in-stock
+# alerts on the next run.
+from config import EventType
+from listing_snapshots import product_hash
+from storage import get_store
+
+MAX_ITEMS_PER_ALERT = 10
+
+def log(msg: str):
+    print(msg)
+
+def normalize_size(size):
+    return str(size).strip().upper()
+
+class StockIndex:
+    def __init__(self, subscriptions):
+        """subscriptions: iterable of (product_url, size, user_id)"""
+        self.by_product = {}  # product hash -> size -> {user_id}
+        self.urls = {}        # (product hash, size, user_id) -> stored product_url, for removal
+        for product_url, size, user_id in subscriptions:
+            h = product_hash(product_url)
+            size = normalize_size(size)
+            self.by_product.setdefault(h, {}).setdefault(size, set()).add(user_id)
+            self.urls[(h, size, user_id)] = product_url
+
+    def __len__(self):
+        return len(self.urls)
+
+    def subscribers(self, h, size):
+        return self.by_product.get(h, {}).get(normalize_size(size), ())
+
+    def subscription(self, h, size, user_id):
+        """The (product_url, size, user_id) row as stored"""
+        return self.urls[(h, normalize_size(size), user_id)], size, user_id
+
+def find_back_in_stock(diffs, url_buckets, index):
+    """
+    Match the NEW_PRODUCT events of every listing diff to subscribers.
+    Returns (user_id -> [(item, size, subscription)], stats).
+    """
+    alerts = {}
+    seen = set()
+    stats = {"listings": 0, "appeared": 0, "disappeared": 0, "matched": 0}
+
+    for url, diff in diffs.items():
+        bucket = url_buckets.get(url)
+        if bucket is None or not diff.events:
+            continue
+
+        appeared = diff.of_type(EventType.NEW_PRODUCT)
+        stats["listings"] += 1
+        stats["appeared"] += len(appeared)
+        stats["disappeared"] += len(diff.of_type(EventType.REMOVED_PRODUCT))
+
+        size = bucket[2]
+        for event in appeared:
+            h = event["hash"]
+            for user_id in index.subscribers(h, size):
+                # The same product can show up on several price-band URLs of one size
+                if (h, size, user_id) in seen:
+                    continue
+                seen.add((h, size, user_id))
+                alerts.setdefault(user_id, []).append((event["item"], size, index.subscription(h, size, user_id)))
+                stats["matched"] += 1
+
+    return alerts, stats
+
+def format_stock_alert(entries):
+    lines = ["🔔 BACK IN STOCK!", ""]
+    for item, size, _ in entries[:MAX_ITEMS_PER_ALERT]:
+        lines.append(f"👟 {item.get('title', '')} (size {size})")
+        if item.get("price"):
+            lines.append(f"💰 {item['price']}")
+        lines.append(f"🔗 {item.get('link', item['id'])}")
+        lines.append("")
+    if len(entries) > MAX_ITEMS_PER_ALERT:
+        lines.append(f"...and {len(entries) - MAX_ITEMS_PER_ALERT} more")
+    return "\n".join(lines).strip()
+
+def process_stock_alerts(diffs, url_buckets, user_data, delivery, store=None):
+    """
+    The stock stage of a scan: alert subscribers of products that appeared
+    (one message each via delivery) and drop the alerted subscriptions.
+    Returns the user ids alerted.
+    """
+    store = store or get_store()
+    index = StockIndex(store.load_stock_subscriptions())
+
+    alerts, stats = find_back_in_stock(diffs, url_buckets, index)
+
+    done = []
+    alerted = []
+    for user_id, entries in alerts.items():
+        chat_id = (user_data.get(user_id) or {}).get("chat_id")
+        if not isinstance(chat_id, int):
+            continue
+        delivery.send_message(chat_id, format_stock_alert(entries))
+        done.extend(subscription for _, _, subscription in entries)
+        alerted.append(user_id)
+
+    if done:
+        store.remove_stock_alerts(done)
+    log(f"Stock stage: {len(index)} subscriptions, {stats}, alerted {len(alerted)} users")
+    return alerted
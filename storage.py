@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# storage.py - Shared state storage (JSON files or SQLite) for all bot scripts
+#
+# STORAGE_BACKEND=json   (default) the original pretty-printed JSON files
+# STORAGE_BACKEND=sqlite one WAL-mode database with indexed tables
+#
+# One-shot migration of the JSON files into SQLite:
+#   python storage.py migrate [--db timberland.db]
+import glob
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+STORAGE_BACKEND = (os.getenv("STORAGE_BACKEND") or "json").strip().lower()
+SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH") or "timberland.db"
+
+USER_DATA_FILE = "user_data.json"
+STATE_FILE = "shoes_state.json"
+PRICE_HISTORY_FILE = "price_history.json"
+STOCK_ALERTS_FILE = "stock_alerts.json"
+
+# UserDataWriter batching for long-running processes
+USERS_FLUSH_EVERY = int(os.getenv("USERS_FLUSH_EVERY", "200"))
+USERS_FLUSH_SECONDS = float(os.getenv("USERS_FLUSH_SECONDS", "2"))
+
+def log(msg: str):
+    print(msg)
+
+def load_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError as e:
+        # Keep the unreadable file for inspection instead of overwriting it on the next save
+        aside = f"{path}.corrupt-{int(time.time())}"
+        log(f"Error reading {path}: {e}; moved to {aside}")
+        try:
+            os.replace(path, aside)
+        except OSError:
+            pass
+        return default
+    except Exception:
+        return default
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # not supported on this platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def save_json(path: str, data):
+    """
+    Write data to path atomically and durably: unique temp file in the same
+    directory, fsync, rename over the target, fsync the directory. A crash
+    leaves either the old or the new file, never a partial one. Returns True on success
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+        os.chmod(temp_path, 0o644)  # mkstemp creates 0600; keep the old open() permissions
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        _fsync_dir(directory)
+        return True
+    except Exception as e:
+        log(f"Error saving {path}: {e}")
+        try:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+        except Exception:
+            pass
+        return False
+
+def remove_stale_temp_files(path: str):
+    """Temp files from a save that was killed mid-write; the target itself is intact"""
+    for temp_path in glob.glob(glob.escape(path) + ".*.tmp"):
+        try:
+            os.remove(temp_path)
+            log(f"Removed stale {temp_path}")
+        except OSError:
+            pass
+
+def stock_alert_key(product_url, size):
+    return f"{product_url}_{size}"
+
+class JsonStore:
+    """The original file layout: one JSON document per kind of state"""
+
+    def __init__(self):
+        self._price_history = None
+
+    # users
+    def load_users(self):
+        remove_stale_temp_files(USER_DATA_FILE)
+        return load_json(USER_DATA_FILE, {})
+
+    def save_users(self, users, user_ids=None):
+        # A JSON file can only be rewritten whole; user_ids is accepted for API parity
+        return save_json(USER_DATA_FILE, users)
+
+    # sent items per user
+    def load_sent_state(self):
+        return load_json(STATE_FILE, {})
+
+    def save_sent_state(self, state):
+        return save_json(STATE_FILE, state)
+
+    # price history
+    def load_price_product(self, product_id):
+        if self._price_history is None:
+            self._price_history = load_json(PRICE_HISTORY_FILE, {})
+        return self._price_history.get(product_id)
+
+    def save_price_history(self, products):
+        if self._price_history is None:
+            self._price_history = load_json(PRICE_HISTORY_FILE, {})
+        self._price_history.update(products)
+        return save_json(PRICE_HISTORY_FILE, self._price_history)
+
+    # stock subscriptions
+    def load_stock_alerts(self):
+        return load_json(STOCK_ALERTS_FILE, {})
+
+    def add_stock_alert(self, product_url, size, user_id):
+        stock_alerts = load_json(STOCK_ALERTS_FILE, {})
+        subscribers = stock_alerts.setdefault(stock_alert_key(product_url, size), [])
+        if user_id in subscribers:
+            return False
+        subscribers.append(user_id)
+        save_json(STOCK_ALERTS_FILE, stock_alerts)
+        return True
+
+    def load_stock_subscriptions(self):
+        """Every subscription as (product_url, size, user_id)"""
+        rows = []
+        for key, user_ids in load_json(STOCK_ALERTS_FILE, {}).items():
+            product_url, _, size = key.rpartition("_")
+            rows.extend((product_url, size, user_id) for user_id in user_ids)
+        return rows
+
+    def remove_stock_alerts(self, subscriptions):
+        """Drop (product_url, size, user_id) rows in one rewrite. Returns how many existed"""
+        stock_alerts = load_json(STOCK_ALERTS_FILE, {})
+        removed = 0
+        for product_url, size, user_id in subscriptions:
+            key = stock_alert_key(product_url, size)
+            subscribers = stock_alerts.get(key)
+            if subscribers and user_id in subscribers:
+                subscribers.remove(user_id)
+                removed += 1
+                if not subscribers:
+                    del stock_alerts[key]
+        if removed:
+            save_json(STOCK_ALERTS_FILE, stock_alerts)
+        return removed
+
+    # small named documents (e.g. last_update_id), one file each
+    def get_meta(self, name, default):
+        return load_json(f"{name}.json", default)
+
+    def set_meta(self, name, value):
+        return save_json(f"{name}.json", value)
+
+    def close(self):
+        pass
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    state   TEXT,
+    data    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_state ON users(state);
+
+CREATE TABLE IF NOT EXISTS sent_state (
+    user_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS price_products (
+    product_id      TEXT PRIMARY KEY,
+    title           TEXT,
+    lowest_price    INTEGER,
+    highest_price   INTEGER,
+    previous_lowest INTEGER
+);
+CREATE TABLE IF NOT EXISTS price_points (
+    product_id TEXT NOT NULL,
+    price      INTEGER NOT NULL,
+    ts         INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS price_points_product ON price_points(product_id, ts);
+
+CREATE TABLE IF NOT EXISTS stock_subscriptions (
+    product_url TEXT NOT NULL,
+    size        TEXT NOT NULL,
+    user_id     TEXT NOT NULL,
+    PRIMARY KEY (product_url, size, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    name  TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class SqliteStore:
+    """Same API as JsonStore on one SQLite database; every save is one transaction"""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    # users
+    def load_users(self):
+        rows = self.conn.execute("SELECT user_id, data FROM users")
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_users(self, users, user_ids=None):
+        """Upsert users; with user_ids=None the table is made to match users exactly"""
+        ids = list(users.keys()) if user_ids is None else [i for i in user_ids if i in users]
+        rows = [
+            (uid, users[uid].get("chat_id"), users[uid].get("state"), json.dumps(users[uid], ensure_ascii=False))
+            for uid in ids
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO users(user_id, chat_id, state, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET chat_id=excluded.chat_id, state=excluded.state, data=excluded.data",
+                rows,
+            )
+            if user_ids is None:
+                existing = {r[0] for r in self.conn.execute("SELECT user_id FROM users")}
+                gone = [(uid,) for uid in existing - set(users)]
+                self.conn.executemany("DELETE FROM users WHERE user_id = ?", gone)
+            else:
+                gone = [(uid,) for uid in user_ids if uid not in users]
+                self.conn.executemany("DELETE FROM users WHERE user_id = ?", gone)
+        return True
+
+    # sent items per user (the compact per-user document from sent_items.py)
+    def load_sent_state(self):
+        rows = self.conn.execute("SELECT user_id, data FROM sent_state")
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_sent_state(self, state):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO sent_state(user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data=excluded.data",
+                [(uid, json.dumps(s, ensure_ascii=False)) for uid, s in state.items()],
+            )
+        return True
+
+    # price history
+    def load_price_product(self, product_id):
+        row = self.conn.execute(
+            "SELECT title, lowest_price, highest_price, previous_lowest FROM price_products WHERE product_id = ?",
+            (product_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        points = self.conn.execute(
+            "SELECT price, ts FROM price_points WHERE product_id = ? ORDER BY ts, rowid",
+            (product_id,),
+        )
+        return {
+            "title": row[0],
+            "prices": [{"price": price, "timestamp": ts} for price, ts in points],
+            "lowest_price": row[1],
+            "highest_price": row[2],
+            "previous_lowest": row[3],
+        }
+
+    def save_price_history(self, products):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO price_products(product_id, title, lowest_price, highest_price, previous_lowest) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(product_id) DO UPDATE SET title=excluded.title, "
+                "lowest_price=excluded.lowest_price, highest_price=excluded.highest_price, "
+                "previous_lowest=excluded.previous_lowest",
+                [
+                    (pid, p.get("title", ""), p["lowest_price"], p["highest_price"], p.get("previous_lowest"))
+                    for pid, p in products.items()
+                ],
+            )
+            self.conn.executemany("DELETE FROM price_points WHERE product_id = ?", [(pid,) for pid in products])
+            self.conn.executemany(
+                "INSERT INTO price_points(product_id, price, ts) VALUES (?, ?, ?)",
+                ((pid, pt["price"], pt["timestamp"]) for pid, p in products.items() for pt in p.get("prices", [])),
+            )
+        return True
+
+    # stock subscriptions
+    def load_stock_alerts(self):
+        alerts = {}
+        for product_url, size, user_id in self.conn.execute(
+            "SELECT product_url, size, user_id FROM stock_subscriptions"
+        ):
+            alerts.setdefault(stock_alert_key(product_url, size), []).append(user_id)
+        return alerts
+
+    def add_stock_alert(self, product_url, size, user_id):
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO stock_subscriptions(product_url, size, user_id) VALUES (?, ?, ?)",
+                (product_url, str(size), user_id),
+            )
+        return cur.rowcount > 0
+
+    def load_stock_subscriptions(self):
+        """Every subscription as (product_url, size, user_id)"""
+        return self.conn.execute("SELECT product_url, size, user_id FROM stock_subscriptions").fetchall()
+
+    def remove_stock_alerts(self, subscriptions):
+        """Drop (product_url, size, user_id) rows in one transaction. Returns how many existed"""
+        with self.conn:
+            cur = self.conn.executemany(
+                "DELETE FROM stock_subscriptions WHERE product_url = ? AND size = ? AND user_id = ?",
+                [(product_url, str(size), user_id) for product_url, size, user_id in subscriptions],
+            )
+        return cur.rowcount
+
+    # small named documents
+    def get_meta(self, name, default):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, name, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO meta(name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+                (name, json.dumps(value, ensure_ascii=False)),
+            )
+        return True
+
+    def close(self):
+        self.conn.close()
+
+class UserDataWriter:
+    """
+    Write-behind for a long-running process's user_data. Handlers change the
+    dict in place and call mark_dirty(user_id); changes are written in one
+    batch once flush_every users are dirty or the oldest change is
+    flush_seconds old (the caller drives this with maybe_flush()). Meta such
+    as the update checkpoint is written only after the users it covers, and a
+    failed flush keeps everything dirty for the next attempt.
+    """
+
+    def __init__(self, users, store=None, flush_every=USERS_FLUSH_EVERY, flush_seconds=USERS_FLUSH_SECONDS):
+        self.users = users
+        self.store = store or get_store()
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.dirty = set()
+        self.dirty_since = None
+        self.pending_meta = {}
+        self.stats = {"flushes": 0, "users_written": 0, "failures": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def mark_dirty(self, user_id):
+        self.dirty.add(str(user_id))
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+
+    def set_meta(self, name, value):
+        """Queue a meta value to be written with the next flush, after the users"""
+        self.pending_meta[name] = value
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+
+    def seconds_until_due(self, now=None):
+        """None when nothing is pending, else how long until the timer fires (0 = now)"""
+        if self.dirty_since is None:
+            return None
+        if len(self.dirty) >= self.flush_every:
+            return 0.0
+        now = now if now is not None else time.monotonic()
+        return max(0.0, self.dirty_since + self.flush_seconds - now)
+
+    def maybe_flush(self, now=None):
+        if self.seconds_until_due(now) == 0:
+            return self.flush()
+        return True
+
+    def flush(self):
+        if self.dirty_since is None:
+            return True
+        ids = set(self.dirty)
+        try:
+            ok = self.store.save_users(self.users, user_ids=ids)
+            if ok:
+                for name, value in self.pending_meta.items():
+                    ok = self.store.set_meta(name, value) and ok
+        except Exception as e:
+            log(f"Error saving users: {e}")
+            ok = False
+
+        if not ok:
+            self.stats["failures"] += 1
+            return False
+
+        self.dirty -= ids
+        self.pending_meta = {}
+        self.dirty_since = time.monotonic() if self.dirty else None
+        self.stats["flushes"] += 1
+        self.stats["users_written"] += len(ids)
+        return True
+
+    def close(self):
+        """Final flush; logs instead of raising so shutdown always completes"""
+        if not self.flush():
+            log(f"WARNING: {len(self.dirty)} user change(s) could not be saved on shutdown")
+
+_store = None
+
+def get_store():
+    """The process-wide store for STORAGE_BACKEND"""
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND == "sqlite":
+            _store = SqliteStore(SQLITE_PATH)
+        elif STORAGE_BACKEND == "json":
+            _store = JsonStore()
+        else:
+            raise SystemExit(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _store
+
+def migrate_json_to_sqlite(db_path=SQLITE_PATH):
+    """Copy every JSON state file into a SQLite database (existing rows are overwritten)"""
+    from sent_items import SentItems, count_entries
+
+    src = JsonStore()
+    dst = SqliteStore(db_path)
+
+    users = src.load_users()
+    dst.save_users(users)
+
+    sent_state = src.load_sent_state()
+    dst.save_sent_state({uid: SentItems.from_state(s).to_state() for uid, s in sent_state.items()})
+    sent_count = count_entries(sent_state)
+
+    price_history = load_json(PRICE_HISTORY_FILE, {})
+    dst.save_price_history(price_history)
+
+    stock_alerts = src.load_stock_alerts()
+    subscriptions = 0
+    for key, user_ids in stock_alerts.items():
+        product_url, _, size = key.rpartition("_")
+        for user_id in user_ids:
+            subscriptions += dst.add_stock_alert(product_url, size, user_id)
+
+    last_update = src.get_meta("last_update_id", None)
+    if last_update is not None:
+        dst.set_meta("last_update_id", last_update)
+
+    dst.close()
+    log(
+        f"Migrated into {db_path}: {len(users)} users, "
+        f"{sent_count} sent items, "
+        f"{len(price_history)} priced products, {subscriptions} stock subscriptions"
+    )
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bot state storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="copy the JSON state files into SQLite")
+    migrate.add_argument("--db", default=SQLITE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        migrate_json_to_sqlite(args.db)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# telegram_client.py - One shared Telegram Bot API client for every script
+#
+# Keeps a single keep-alive requests.Session (so api.telegram.org is not
+# re-handshaked per message), retries in a loop with exponential backoff and
+# full jitter, honours 429 retry_after, and stops retrying once the
+# process-wide retry budget is spent. Every call returns a TelegramResult.
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TELEGRAM_BOT_TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN") or "").strip()
+TELEGRAM_API_BASE = (os.getenv("TELEGRAM_API_BASE") or "https://api.telegram.org").rstrip("/")
+
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "16"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+TELEGRAM_RETRY_BUDGET = int(os.getenv("TELEGRAM_RETRY_BUDGET", "100"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+MAX_RETRY_AFTER_SECONDS = 60
+REQUEST_TIMEOUT_SECONDS = 30
+
+def log(msg: str):
+    print(msg)
+
+@dataclass
+class TelegramResult:
+    method: str
+    ok: bool = False
+    status_code: int = 0
+    chat_id: object = None
+    attempts: int = 0
+    retry_after: int = None
+    error: str = None
+    data: dict = field(default_factory=dict)
+
+    def __bool__(self):
+        return self.ok
+
+def retry_after_seconds(response, default=5):
+    """Telegram puts retry_after in the JSON body; some proxies only send the header"""
+    try:
+        value = response.json().get("parameters", {}).get("retry_after")
+        if value is not None:
+            return int(value)
+    except Exception:
+        pass
+    try:
+        return int(response.headers.get("Retry-After", default))
+    except Exception:
+        return default
+
+class TelegramClient:
+    def __init__(self, token=TELEGRAM_BOT_TOKEN, api_base=TELEGRAM_API_BASE, pool_size=TELEGRAM_POOL_SIZE,
+                 max_retries=TELEGRAM_MAX_RETRIES, retry_budget=TELEGRAM_RETRY_BUDGET):
+        self.api = f"{api_base}/bot{token}"
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "ok": 0, "failed": 0, "retries": 0, "rate_limited": 0}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _take_retry(self):
+        with self.lock:
+            if self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            self.stats["retries"] += 1
+            return True
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given (1-based) attempt"""
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+    def call(self, method, payload=None, chat_id=None, max_retries=None, http_method="POST", timeout=REQUEST_TIMEOUT_SECONDS):
+        """
+        Call a Bot API method. Retries timeouts, connection errors, 5xx and 429
+        up to max_retries times (0 = single attempt, the caller handles 429).
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        result = TelegramResult(method=method, chat_id=chat_id)
+        url = f"{self.api}/{method}"
+
+        while True:
+            result.attempts += 1
+            delay = None
+            try:
+                if http_method == "GET":
+                    r = self.session.get(url, params=payload, timeout=timeout)
+                else:
+                    r = self.session.post(url, data=payload, timeout=timeout)
+                self._count("calls")
+                result.status_code = r.status_code
+                result.error = None
+
+                try:
+                    result.data = r.json()
+                except ValueError:
+                    result.data = {}
+
+                if r.status_code == 200:
+                    result.ok = bool(result.data.get("ok", True))
+                    break
+
+                result.error = result.data.get("description") or f"HTTP {r.status_code}"
+                if r.status_code == 429:
+                    self._count("rate_limited")
+                    result.retry_after = retry_after_seconds(r)
+                    delay = min(result.retry_after, MAX_RETRY_AFTER_SECONDS)
+                elif r.status_code >= 500:
+                    delay = self.backoff(result.attempts)
+                else:
+                    break  # 4xx other than 429 will not succeed on retry
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self._count("calls")
+                result.error = str(e)
+                delay = self.backoff(result.attempts)
+            except Exception as e:
+                result.error = str(e)
+                break
+
+            if result.attempts > max_retries or not self._take_retry():
+                break
+            log(f"{method} retry {result.attempts}/{max_retries} in {delay:.1f}s: {result.error}")
+            time.sleep(delay)
+
+        self._count("ok" if result.ok else "failed")
+        return result
+
+    def send_message(self, chat_id, text, disable_web_page_preview=True, **kwargs):
+        payload = {"chat_id": chat_id, "text": text[:4096]}  # Telegram message limit
+        if disable_web_page_preview:
+            payload["disable_web_page_preview"] = True
+        return self.call("sendMessage", payload, chat_id=chat_id, **kwargs)
+
+    def get_updates(self, offset, timeout=0, limit=None):
+        params = {"offset": offset}
+        if timeout:
+            params["timeout"] = timeout
+        if limit:
+            params["limit"] = limit
+        # The HTTP timeout has to outlive Telegram's long-poll timeout
+        return self.call("getUpdates", params, http_method="GET", timeout=timeout + REQUEST_TIMEOUT_SECONDS)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """The process-wide client built from TELEGRAM_BOT_TOKEN / TELEGRAM_API_BASE"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TelegramClient()
+        return _client
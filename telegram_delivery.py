@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# telegram_delivery.py - Queued, rate-limited Telegram delivery on a worker pool
+#
+# Messages are queued per chat and sent by DELIVERY_WORKERS threads. Two token
+# buckets keep us inside Telegram's limits: ~30 msg/s for the bot overall and
+# ~1 msg/s per chat. Messages to one chat go out in order, one at a time; a 429
+# only pushes back that chat (by its Retry-After, capped at
+# MAX_RETRY_AFTER_SECONDS), other chats keep flowing. close() drains for at
+# most DELIVERY_DRAIN_SECONDS; whatever is still queued then is dropped and
+# counted, so a long flood-wait cannot hang the run past its state save.
+# Calls go through the shared telegram_client session with its retries off:
+# the queue does its own per-chat retry scheduling.
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from run_profiler import profiler
+from telegram_client import MAX_RETRY_AFTER_SECONDS, get_client
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+GLOBAL_RATE_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+PER_CHAT_RATE_PER_SECOND = float(os.getenv("TELEGRAM_PER_CHAT_RATE", "1"))
+DELIVERY_DRAIN_SECONDS = float(os.getenv("DELIVERY_DRAIN_SECONDS", "600"))
+MAX_ATTEMPTS = 5
+ALBUM_MAX_ITEMS = 10  # Telegram's sendMediaGroup limit
+
+def log(msg: str):
+    print(msg)
+
+class TokenBucket:
+    """Classic token bucket; callers hold the queue lock"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_take(self, now):
+        """Take a token if one is available. Returns 0, or seconds until one will be"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class _Job:
+    __slots__ = ("chat_id", "method", "payload", "attempts", "fallback")
+
+    def __init__(self, chat_id, method, payload, fallback=None):
+        self.chat_id = chat_id
+        self.method = method
+        self.payload = payload
+        self.attempts = 0
+        self.fallback = fallback  # [(method, payload)] to send instead if Telegram rejects this one
+
+class DeliveryQueue:
+    def __init__(self, client=None, workers=DELIVERY_WORKERS, global_rate=GLOBAL_RATE_PER_SECOND,
+                 per_chat_rate=PER_CHAT_RATE_PER_SECOND):
+        self.client = client or get_client()
+        self.workers = max(1, int(workers))
+        self.per_chat_interval = 1.0 / per_chat_rate
+        self.global_bucket = TokenBucket(global_rate)
+
+        self.cond = threading.Condition()
+        self.pending = {}     # chat_id -> deque of jobs
+        self.ready_at = {}    # chat_id -> monotonic time the chat may send again
+        self.ready_heap = []  # (ready_at, seq, chat_id) for chats with work and nothing in flight
+        self.in_flight = set()
+        self.seq = itertools.count()
+        self.closing = False
+        self.dropping = False
+        self.threads = []
+
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "rate_limited": 0, "api_calls": 0, "fallbacks": 0,
+                      "dropped": 0}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"telegram-delivery-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def send_message(self, chat_id, text):
+        self.enqueue(chat_id, "sendMessage", {
+            "chat_id": chat_id,
+            "text": text[:4096],  # Telegram message limit
+            "disable_web_page_preview": True,
+        })
+
+    def send_photo(self, chat_id, photo_url, caption):
+        self.enqueue(chat_id, "sendPhoto", {
+            "chat_id": chat_id,
+            "photo": photo_url,
+            "caption": caption[:950],
+        })
+
+    def send_photos(self, chat_id, photos):
+        """
+        Send [(photo_url, caption)] as albums of up to ALBUM_MAX_ITEMS photos, each
+        photo keeping its own caption. If Telegram rejects an album (one bad
+        image is enough), its photos are sent one by one instead.
+        """
+        for start in range(0, len(photos), ALBUM_MAX_ITEMS):
+            chunk = photos[start:start + ALBUM_MAX_ITEMS]
+            if len(chunk) == 1:
+                self.send_photo(chat_id, *chunk[0])
+                continue
+
+            media = [{"type": "photo", "media": url, "caption": caption[:1024]} for url, caption in chunk]
+            singles = [
+                ("sendPhoto", {"chat_id": chat_id, "photo": url, "caption": caption[:950]})
+                for url, caption in chunk
+            ]
+            self.enqueue(chat_id, "sendMediaGroup", {
+                "chat_id": chat_id,
+                "media": json.dumps(media, ensure_ascii=False),
+            }, fallback=singles)
+
+    def enqueue(self, chat_id, method, payload, fallback=None):
+        with self.cond:
+            queue = self.pending.get(chat_id)
+            if queue is None:
+                queue = self.pending[chat_id] = deque()
+            queue.append(_Job(chat_id, method, payload, fallback))
+            self.stats["queued"] += 1
+            if len(queue) == 1 and chat_id not in self.in_flight:
+                self._schedule(chat_id)
+            self.cond.notify()
+
+    def _schedule(self, chat_id):
+        heapq.heappush(self.ready_heap, (self.ready_at.get(chat_id, 0.0), next(self.seq), chat_id))
+
+    def _next_job(self):
+        """Block until some chat may send and a global token is free. None once closed and drained"""
+        with self.cond:
+            while True:
+                if not self.ready_heap:
+                    if self.closing and not self.in_flight:
+                        return None
+                    self.cond.wait()
+                    continue
+
+                ready_at, _, chat_id = self.ready_heap[0]
+                now = time.monotonic()
+                if ready_at > now:
+                    self.cond.wait(ready_at - now)
+                    continue
+
+                wait = self.global_bucket.try_take(now)
+                if wait:
+                    self.cond.wait(wait)
+                    continue
+
+                heapq.heappop(self.ready_heap)
+                self.in_flight.add(chat_id)
+                return self.pending[chat_id].popleft()
+
+    def _finish(self, job, retry_after=None, retry=False, replace_with=None):
+        with self.cond:
+            chat_id = job.chat_id
+            self.in_flight.discard(chat_id)
+            delay = retry_after if retry_after is not None else self.per_chat_interval
+            self.ready_at[chat_id] = time.monotonic() + delay
+
+            queue = self.pending[chat_id]
+            if self.dropping:
+                # Past the drain deadline: nothing new goes back on the queue
+                self.stats["dropped"] += int(retry) + len(replace_with or [])
+                retry, replace_with = False, None
+            if retry:
+                queue.appendleft(job)
+            for method, payload in reversed(replace_with or []):
+                queue.appendleft(_Job(chat_id, method, payload))
+                self.stats["queued"] += 1
+            if queue:
+                self._schedule(chat_id)
+            else:
+                del self.pending[chat_id]
+            self.cond.notify_all()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            job.attempts += 1
+            retry_after = None
+            retry = False
+            replace_with = None
+            with profiler.stage(f"telegram.{job.method}"):
+                result = self.client.call(job.method, job.payload, chat_id=job.chat_id, max_retries=0)
+            with self.cond:
+                self.stats["api_calls"] += 1
+            if result.status_code == 429:
+                retry_after = min(result.retry_after or 1, MAX_RETRY_AFTER_SECONDS)
+                retry = job.attempts < MAX_ATTEMPTS
+                with self.cond:
+                    self.stats["rate_limited"] += 1
+                log(f"{job.method} to {job.chat_id} rate limited, retry in {retry_after}s")
+            elif result.status_code >= 500 or result.status_code == 0:
+                # 5xx, timeout or connection error
+                log(f"{job.method} to {job.chat_id} failed: {result.error}")
+                retry = job.attempts < MAX_ATTEMPTS
+                retry_after = min(2 ** job.attempts, 30)
+            elif result.status_code == 400 and job.fallback:
+                log(f"{job.method} to {job.chat_id} rejected, falling back to {len(job.fallback)} single sends")
+                replace_with = job.fallback
+                with self.cond:
+                    self.stats["fallbacks"] += 1
+            ok = result.ok
+
+            if not retry and not replace_with:
+                with self.cond:
+                    self.stats["sent" if ok else "failed"] += 1
+            self._finish(job, retry_after=retry_after, retry=retry, replace_with=replace_with)
+
+    def close(self, timeout=DELIVERY_DRAIN_SECONDS):
+        """Deliver what is still queued (for at most timeout seconds), then stop the workers"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self.threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        if any(t.is_alive() for t in self.threads):
+            self._drop_pending(timeout)
+            # Only calls already in flight are left, each bounded by the request timeout
+            for t in self.threads:
+                t.join()
+        self.threads = []
+        log(f"Delivery stats: {self.stats}")
+
+    def _drop_pending(self, timeout):
+        with self.cond:
+            self.dropping = True
+            dropped = 0
+            for chat_id in list(self.pending):
+                dropped += len(self.pending[chat_id])
+                if chat_id in self.in_flight:
+                    self.pending[chat_id].clear()  # _finish still needs the entry
+                else:
+                    del self.pending[chat_id]
+            self.ready_heap = []
+            self.stats["dropped"] += dropped
+            self.cond.notify_all()
+        log(f"WARNING: delivery drain deadline ({timeout:.0f}s) hit, dropped {dropped} queued message(s)")
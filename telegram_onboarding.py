@@ -1,15 +1,25 @@
 # telegram_onboarding.py
-import json
+#
+# Cron mode (default) handles pending messages once and exits;
+#   python telegram_onboarding.py --daemon
+# long-polls getUpdates and answers within seconds.
+import argparse
+import math
 import os
 import re
+import signal
 import time
-import requests
 
-USER_DATA_FILE = "user_data.json"
-LAST_UPDATE_ID_FILE = "last_update_id.json"
+from listing_snapshots import product_key
+from storage import UserDataWriter, get_store
+from telegram_client import TELEGRAM_BOT_TOKEN, get_client
 
-TELEGRAM_BOT_TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN") or "").strip()
-API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Stored as last_update_id.json with the JSON backend
+LAST_UPDATE_META = "last_update_id"
+
+UPDATES_PAGE_LIMIT = 100  # getUpdates maximum
+POLL_TIMEOUT_SECONDS = int(os.getenv("ONBOARDING_POLL_TIMEOUT", "50"))
+DAEMON_MAX_BACKOFF_SECONDS = 60
 
 ENABLE_DEBUG_LOGS = True
 
@@ -48,32 +58,10 @@ def log(msg: str):
     if ENABLE_DEBUG_LOGS:
         print(msg)
 
-def load_json(path: str, default):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return default
-    except Exception:
-        return default
-
-def save_json(path: str, data):
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
-
 def send_message(chat_id: int, text: str):
-    url = f"{API}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text,
-        "disable_web_page_preview": True,
-    }
-    r = requests.post(url, data=payload, timeout=30)
-    log(f"send_message to {chat_id} -> status {r.status_code}")
-    return r
+    result = get_client().send_message(chat_id, text)
+    log(f"send_message to {chat_id} -> status {result.status_code} ({result.attempts} attempt(s))")
+    return result
 
 def parse_one_line(text: str):
     """
@@ -155,7 +143,34 @@ def parse_one_line(text: str):
         "price_max": price_max,
     }
 
-def handle_message(chat_id: int, text: str, user_data: dict):
+def default_stock_size(user: dict):
+    """The size a /stock subscription uses when none is given: the user's own"""
+    if user.get("category") in ("shoes", "both") and user.get("shoes_size"):
+        return str(user["shoes_size"])
+    if user.get("clothing_size"):
+        return str(user["clothing_size"]).upper()
+    return None
+
+def handle_stock_command(chat_id: int, text: str, user: dict, send):
+    """/stock <product link> [size] - alert once when the product is back in that size"""
+    parts = text.split()
+    url = parts[1] if len(parts) > 1 else ""
+    size = parts[2].upper() if len(parts) > 2 else default_stock_size(user)
+
+    if not url.startswith("http") or "timberland" not in url:
+        send(chat_id, "Usage: /stock <Timberland product link> [size]\n\nExample: /stock https://www.timberland.co.il/... 43")
+        return
+    if not size:
+        send(chat_id, "Which size? Example: /stock <product link> 43")
+        return
+
+    if get_store().add_stock_alert(product_key(url), size, str(chat_id)):
+        send(chat_id, f"🔔 Got it! We'll message you when it's in stock in size {size}.")
+    else:
+        send(chat_id, f"You're already subscribed to this product in size {size}.")
+
+def handle_message(chat_id: int, text: str, user_data: dict, send=send_message):
+    """Reply via send(chat_id, text); the webhook server passes a queued sender"""
     text = (text or "").strip()
     if text == "":
         return
@@ -166,23 +181,27 @@ def handle_message(chat_id: int, text: str, user_data: dict):
     # Commands (always)
     if text == "/reset":
         user_data[str(chat_id)] = {"chat_id": chat_id, "state": "awaiting_setup", "welcome_sent": False}
-        send_message(chat_id, "Reset completed. Send /start and then your setup message.")
+        send(chat_id, "Reset completed. Send /start and then your setup message.")
         return
 
     if text == "/stat":
         total = len(user_data)
         ready = sum(1 for v in user_data.values() if v.get("state") == "ready")
         awaiting = total - ready
-        send_message(chat_id, f"Bot Status\n\nTotal users: {total}\nReady: {ready}\nAwaiting setup: {awaiting}")
+        send(chat_id, f"Bot Status\n\nTotal users: {total}\nReady: {ready}\nAwaiting setup: {awaiting}")
+        return
+
+    if text == "/stock" or text.startswith("/stock "):
+        handle_stock_command(chat_id, text, user, send)
         return
 
     if text == "/start":
         # רק אם לא נשלח בעבר, כדי לא להציף
         if not user.get("welcome_sent"):
-            send_message(chat_id, WELCOME_TEXT)
+            send(chat_id, WELCOME_TEXT)
             user["welcome_sent"] = True
         else:
-            send_message(
+            send(
                 chat_id,
                 "ℹ️ ההוראות כבר נשלחו בעבר.\n"
                 "שלח הודעה בפורמט: 1 A 43 128 299\n"
@@ -195,7 +214,7 @@ def handle_message(chat_id: int, text: str, user_data: dict):
     parsed = parse_one_line(text)
     if not parsed:
         if user.get("state") != "ready":
-            send_message(
+            send(
                 chat_id,
                 "Invalid format.\n\n"
                 "Example: 1 A 43 128 299\n"
@@ -235,47 +254,25 @@ def handle_message(chat_id: int, text: str, user_data: dict):
         "",
         "Products sent twice daily (Israel time): 07:00 and 19:00",
     ]
-    send_message(chat_id, "\n".join(lines))
+    send(chat_id, "\n".join(lines))
 
-def get_updates(offset: int):
-    params = {"offset": offset}
-    r = requests.get(f"{API}/getUpdates", params=params, timeout=30)
-    data = r.json()
-    if not data.get("ok"):
-        raise SystemExit(f"Telegram getUpdates failed: {data}")
-    return data.get("result", [])
+def get_updates(offset: int, timeout: int = 0, limit: int = UPDATES_PAGE_LIMIT):
+    result = get_client().get_updates(offset, timeout=timeout, limit=limit)
+    if not result.ok:
+        raise SystemExit(f"Telegram getUpdates failed: {result.data or result.error}")
+    return result.data.get("result", [])
 
-def main():
-    if not TELEGRAM_BOT_TOKEN:
-        raise SystemExit("Missing TELEGRAM_BOT_TOKEN in GitHub Secrets.")
-
-    log("=== telegram_onboarding.py starting ===")
-
-    user_data = load_json(USER_DATA_FILE, {})
-    last_obj = load_json(LAST_UPDATE_ID_FILE, {"last_update_id": 0})
-
-    last_update = last_obj.get("last_update_id")
-    if not isinstance(last_update, int):
-        last_update = 0
-
-    # Get all updates
-    updates = get_updates(last_update + 1)
-    log(f"getUpdates returned {len(updates)} updates (last_update_id: {last_update})")
-
-    if not updates:
-        log("No new updates to process")
-        return
-
-    # Process all messages (not just newest per chat)
-    max_update_id = last_update
+def process_updates(updates, user_data, fresh_start: bool, init_time=None, send=send_message, writer=None):
+    """
+    Handle one batch of updates in order. fresh_start means there was no
+    checkpoint when the run began, so old backlog messages are skipped.
+    Each user touched is marked dirty on writer (a storage.UserDataWriter).
+    Returns (max_update_id, processed_count).
+    """
+    max_update_id = 0
     now_ts = int(time.time())
     processed_count = 0
-    
-    # Check if this is first run with init_time
-    init_time = last_obj.get("init_time")
-    is_first_run = (last_update == 0 and init_time is not None)
-    
-    log(f"Processing mode: {'first_run' if is_first_run else 'normal'}, init_time: {init_time}")
+    is_first_run = (fresh_start and init_time is not None)
 
     for upd in updates:
         uid = upd.get("update_id")
@@ -298,19 +295,67 @@ def main():
                 if msg_date < init_time:
                     log(f"Skipping old message from {chat_id} (before init_time)")
                     continue
-            elif last_update == 0:
+            elif fresh_start:
                 # Fallback: skip very old messages
                 if now_ts - msg_date > MAX_MESSAGE_AGE_SECONDS:
                     log(f"Skipping old message from {chat_id} (age: {now_ts - msg_date}s)")
                     continue
 
         text = msg.get("text", "")
-        handle_message(chat_id, text, user_data)
+        handle_message(chat_id, text, user_data, send=send)
+        if writer is not None:
+            writer.mark_dirty(chat_id)
         processed_count += 1
 
-    save_json(USER_DATA_FILE, user_data)
-    save_json(LAST_UPDATE_ID_FILE, {"last_update_id": max_update_id})
-    log(f"Onboarding done. Processed {processed_count} messages from {len(updates)} updates")
+    return max_update_id, processed_count
+
+def load_checkpoint(store):
+    last_obj = store.get_meta(LAST_UPDATE_META, {"last_update_id": 0})
+    last_update = last_obj.get("last_update_id")
+    if not isinstance(last_update, int):
+        last_update = 0
+    return last_update, last_obj.get("init_time")
+
+def checkpoint(writer, last_update_id):
+    """The checkpoint is written with (after) the users of the same batch, so a restart never re-answers it"""
+    writer.set_meta(LAST_UPDATE_META, {"last_update_id": last_update_id})
+
+def run_once():
+    """Cron mode: drain everything pending (page by page) and exit"""
+    log("=== telegram_onboarding.py starting ===")
+
+    store = get_store()
+    user_data = store.load_users()
+    last_update, init_time = load_checkpoint(store)
+    fresh_start = last_update == 0
+
+    log(f"Processing mode: {'first_run' if fresh_start and init_time is not None else 'normal'}, init_time: {init_time}")
+
+    max_update_id = last_update
+    processed_count = 0
+    total_updates = 0
+    with UserDataWriter(user_data, store) as writer:
+        while True:
+            updates = get_updates(max_update_id + 1)
+            log(f"getUpdates returned {len(updates)} updates (last_update_id: {max_update_id})")
+            if not updates:
+                break
+
+            batch_max, batch_processed = process_updates(updates, user_data, fresh_start, init_time, writer=writer)
+            max_update_id = max(max_update_id, batch_max)
+            processed_count += batch_processed
+            total_updates += len(updates)
+            checkpoint(writer, max_update_id)
+            writer.flush()
+
+            if len(updates) < UPDATES_PAGE_LIMIT:
+                break
+
+    if not total_updates:
+        log("No new updates to process")
+        return
+
+    log(f"Onboarding done. Processed {processed_count} messages from {total_updates} updates")
     log(f"Updated last_update_id from {last_update} to {max_update_id}")
     log(f"Total users: {len(user_data)}")
     
@@ -323,5 +368,78 @@ def main():
     
     log(f"State saved with last_update_id: {max_update_id}")
 
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def run_daemon(poll_timeout: int = POLL_TIMEOUT_SECONDS):
+    """
+    Persistent mode: long-poll getUpdates so replies go out within seconds.
+    Telegram holds each request open for up to poll_timeout seconds and
+    returns as soon as a message arrives. The users each batch of updates
+    touched and its checkpoint are flushed together before the next poll, so
+    a restart neither loses answered users nor re-answers their updates. A
+    failed flush stays pending and the poll is cut short to retry it.
+    """
+    log(f"=== telegram_onboarding.py daemon starting (long poll {poll_timeout}s) ===")
+    signal.signal(signal.SIGTERM, _stop)
+
+    store = get_store()
+    user_data = store.load_users()
+    last_update, init_time = load_checkpoint(store)
+    # Old-message filtering only applies while draining the initial backlog
+    fresh_start = last_update == 0
+    failures = 0
+    writer = UserDataWriter(user_data, store)
+
+    try:
+        while True:
+            # No long poll while a backlog is still being paged through
+            timeout = 0 if fresh_start else poll_timeout
+            due = writer.seconds_until_due()
+            if due is not None:
+                timeout = min(timeout, math.ceil(due))
+            result = get_client().get_updates(last_update + 1, timeout=timeout, limit=UPDATES_PAGE_LIMIT)
+            if not result.ok:
+                failures += 1
+                delay = min(DAEMON_MAX_BACKOFF_SECONDS, 2 ** failures)
+                log(f"getUpdates failed ({result.error}), retrying in {delay}s")
+                writer.maybe_flush()
+                time.sleep(delay)
+                continue
+            failures = 0
+
+            updates = result.data.get("result", [])
+            if updates:
+                batch_max, processed = process_updates(updates, user_data, fresh_start, init_time, writer=writer)
+                last_update = max(last_update, batch_max)
+                checkpoint(writer, last_update)
+                writer.flush()
+                log(f"Processed {processed} messages from {len(updates)} updates (last_update_id: {last_update})")
+            else:
+                writer.maybe_flush()
+
+            if len(updates) < UPDATES_PAGE_LIMIT:
+                fresh_start = False
+    except KeyboardInterrupt:
+        log(f"Daemon stopping, last_update_id: {last_update}")
+    finally:
+        writer.close()
+        log(f"User writes: {writer.stats}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Telegram onboarding bot")
+    parser.add_argument("--daemon", action="store_true",
+                        help="long-poll getUpdates forever instead of a single cron pass")
+    parser.add_argument("--poll-timeout", type=int, default=POLL_TIMEOUT_SECONDS)
+    args = parser.parse_args(argv)
+
+    if not TELEGRAM_BOT_TOKEN:
+        raise SystemExit("Missing TELEGRAM_BOT_TOKEN in GitHub Secrets.")
+
+    if args.daemon:
+        run_daemon(args.poll_timeout)
+    else:
+        run_once()
+
 if __name__ == "__main__":
     main()
@@ -1,108 +1,66 @@
 # timberland_checker.py
+import argparse
 import json
 import os
 import time
-import requests
 from datetime import datetime, timezone, timedelta
 
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright
-from live_coupon_checker import get_formatted_coupons
-from smart_alerts import process_smart_alerts, get_price_history_summary, generate_share_link, extract_price
+from browser_pool import BrowserPool
+from http_fetcher import fetch_static_many
+from listing_parsers import PARSER_BACKEND, parse_listing
+from listing_snapshots import ListingSnapshots, count_events, page_fingerprint
+from storage import get_store, load_json, save_json
+from telegram_delivery import DeliveryQueue
+from user_index import user_buckets
+from sent_items import SentItems, count_entries, item_hash
+from live_coupon_checker import get_formatted_coupons, prefetch_coupons
+from run_profiler import profiler
+from smart_alerts import (
+    process_smart_alerts,
+    check_stock_alerts,
+    get_price_history_summary,
+    get_price_product,
+    generate_share_link,
+    extract_price,
+    record_listing_prices,
+    flush_price_history,
+)
 
-USER_DATA_FILE = "user_data.json"
-STATE_FILE = "shoes_state.json"
 SHOES_SIZE_MAP_FILE = "size_map.json"
 APPAREL_SIZE_MAP_FILE = "apparel_size_map.json"
+FETCH_STRATEGY_FILE = "fetch_strategy.json"
+
+# Overridable so benchmarks/bench_checker.py can point the scan at a local server
+SITE_BASE_URL = (os.getenv("TIMBERLAND_BASE_URL") or "https://www.timberland.co.il").rstrip("/")
 
 TELEGRAM_BOT_TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN") or "").strip()
-API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
 
 ENABLE_DEBUG_LOGS = True
 
+MAX_ITEMS_PER_RUN = 20  # per user
+
 IL_TZ = timezone(timedelta(hours=2))  # Israel (no DST handling here)
 SEND_HOURS_IL = {7, 19}
 
+# How the price band reaches the listing URL:
+#   "user"  - each user's own price_min/price_max in the query string (one render per band)
+#   "union" - one URL per (category, gender, size) bucket using the union of its users' bands
+#   "none"  - one URL per bucket with no price filter at all
+# In "union"/"none" every user's own range is applied locally with extract_price.
+PRICE_FILTER_MODE = (os.getenv("PRICE_FILTER_MODE") or "user").strip().lower()
+
+# URLs that needed the browser last time skip the HTTP attempt, but are
+# re-probed over plain HTTP once their record is older than this.
+STRATEGY_REPROBE_SECONDS = 7 * 24 * 60 * 60
+
+# Magento renders this notice when a filter matches nothing; a static page
+# carrying it is a real empty listing, not a page that needs JavaScript.
+EMPTY_LISTING_MARKER = "message info empty"
+
 def log(msg: str):
     if ENABLE_DEBUG_LOGS:
         print(msg)
 
-def load_json(path: str, default):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return default
-    except Exception:
-        return default
-
-def save_json(path: str, data):
-    import tempfile
-    import shutil
-    
-    try:
-        # Write to temporary file first
-        temp_path = path + ".tmp"
-        with open(temp_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        # Atomic move to final location
-        shutil.move(temp_path, path)
-        log(f"Successfully saved {path}")
-        
-    except Exception as e:
-        log(f"Error saving {path}: {e}")
-        # Try to clean up temp file
-        try:
-            if os.path.exists(path + ".tmp"):
-                os.remove(path + ".tmp")
-        except:
-            pass
-
-def send_message(chat_id: int, text: str, retry_count=0):
-    if retry_count > 3:
-        log(f"Max retries reached for message to {chat_id}")
-        return None
-        
-    url = f"{API}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text[:4096],  # Telegram message limit
-        "disable_web_page_preview": True,
-    }
-    
-    try:
-        r = requests.post(url, data=payload, timeout=30)
-        
-        if r.status_code == 429:  # Rate limited
-            retry_after = int(r.headers.get('Retry-After', 60))
-            log(f"Rate limited, waiting {retry_after} seconds")
-            time.sleep(min(retry_after, 60))  # Max 60 seconds wait
-            return send_message(chat_id, text, retry_count + 1)
-        
-        log(f"send_message -> {r.status_code}")
-        return r
-        
-    except requests.exceptions.Timeout:
-        log(f"Timeout sending message to {chat_id}, retrying...")
-        time.sleep(5)
-        return send_message(chat_id, text, retry_count + 1)
-    except Exception as e:
-        log(f"Error sending message to {chat_id}: {e}")
-        return None
-
-def send_photo(chat_id: int, photo_url: str, caption: str):
-    url = f"{API}/sendPhoto"
-    payload = {
-        "chat_id": chat_id,
-        "photo": photo_url,
-        "caption": caption[:950],
-        "disable_web_page_preview": True,
-    }
-    r = requests.post(url, data=payload, timeout=30)
-    log(f"send_photo -> {r.status_code}")
-    return r
-
 def in_send_window():
     now_il = datetime.now(IL_TZ)
     return now_il.hour in SEND_HOURS_IL, now_il
@@ -110,11 +68,16 @@ def in_send_window():
 def is_manual_run():
     return (os.getenv("GITHUB_EVENT_NAME") or "").strip() == "workflow_dispatch"
 
-def build_shoes_url(gender: str, shoe_size: str, price_min: int, price_max: int, shoes_size_map: dict):
+def listing_url(base: str, size_code, price_min=None, price_max=None):
+    if price_min is None or price_max is None:
+        return f"{base}?size={size_code}&product_list_order=low_to_high"
+    return f"{base}?price={price_min}_{price_max}&size={size_code}&product_list_order=low_to_high"
+
+def build_shoes_url(gender: str, shoe_size: str, price_min, price_max, shoes_size_map: dict):
     base = {
-        "men": "https://www.timberland.co.il/men/footwear",
-        "women": "https://www.timberland.co.il/women/shoes",
-        "kids": "https://www.timberland.co.il/kids/toddlers-0-5y",
+        "men": f"{SITE_BASE_URL}/men/footwear",
+        "women": f"{SITE_BASE_URL}/women/shoes",
+        "kids": f"{SITE_BASE_URL}/kids/toddlers-0-5y",
     }.get(gender)
 
     if not base:
@@ -124,13 +87,13 @@ def build_shoes_url(gender: str, shoe_size: str, price_min: int, price_max: int,
     if not size_code:
         return None
 
-    return f"{base}?price={price_min}_{price_max}&size={size_code}&product_list_order=low_to_high"
+    return listing_url(base, size_code, price_min, price_max)
 
-def build_clothing_url(gender: str, clothing_size: str, price_min: int, price_max: int, apparel_size_map: dict):
+def build_clothing_url(gender: str, clothing_size: str, price_min, price_max, apparel_size_map: dict):
     base = {
-        "men": "https://www.timberland.co.il/men/clothing",
-        "women": "https://www.timberland.co.il/women/clothing",
-        "kids": "https://www.timberland.co.il/kids/clothing",
+        "men": f"{SITE_BASE_URL}/men/clothing",
+        "women": f"{SITE_BASE_URL}/women/clothing",
+        "kids": f"{SITE_BASE_URL}/kids/clothing",
     }.get(gender)
 
     if not base:
@@ -140,196 +103,399 @@ def build_clothing_url(gender: str, clothing_size: str, price_min: int, price_ma
     if not size_code:
         return None
 
-    return f"{base}?price={price_min}_{price_max}&size={size_code}&product_list_order=low_to_high"
+    return listing_url(base, size_code, price_min, price_max)
 
-def scrape_products(page_html: str, base_url: str):
-    soup = BeautifulSoup(page_html, "html.parser")
-    items = []
+def scrape_products(page_html: str, base_url: str, backend: str = PARSER_BACKEND):
+    with profiler.stage("parse"):
+        try:
+            return parse_listing(page_html, base_url, backend)
+        except Exception as e:
+            log(f"Error parsing listing {base_url}: {e}")
+            return []
 
-    products = soup.select("li.product-item") or soup.select(".product-item")
-    for p in products:
-        title_el = p.select_one(".product-item-link") or p.select_one("a")
-        if not title_el:
-            continue
-        title = title_el.get_text(strip=True)
+def fetch_url_html(pool, url: str):
+    try:
+        with profiler.stage("fetch.browser_page"):
+            return pool.fetch(url)
+    except Exception as e:
+        log(f"Error fetching URL {url}: {e}")
+        return ""
+
+def user_price_band(u: dict):
+    return int(u.get("price_min", 0)), int(u.get("price_max", 999999))
+
+def build_user_urls(user_id: str, u: dict, shoes_size_map: dict, apparel_size_map: dict, bucket_bands=None,
+                    url_buckets=None):
+    """
+    Build (kind, url) pairs for a user. bucket_bands maps a bucket to the price band
+    to put in its URL (see PRICE_FILTER_MODE); without it the user's own band is used.
+    Each URL's bucket is recorded in url_buckets when given.
+    """
+    price_min, price_max = user_price_band(u)
+    urls = []
 
-        href = title_el.get("href") or ""
-        if href and href.startswith("/"):
-            link = "https://www.timberland.co.il" + href
-        elif href.startswith("http"):
-            link = href
+    for bucket in user_buckets(u):
+        kind, gender, size = bucket
+        band_min, band_max = (bucket_bands or {}).get(bucket, (price_min, price_max))
+
+        if kind == "shoes":
+            url = build_shoes_url(gender, size, band_min, band_max, shoes_size_map)
         else:
-            link = base_url
+            url = build_clothing_url(gender, size, band_min, band_max, apparel_size_map)
 
-        img_el = p.select_one("img")
-        img = ""
-        if img_el:
-            img = img_el.get("data-src") or img_el.get("src") or ""
-            if img and img.startswith("//"):
-                img = "https:" + img
+        if url:
+            urls.append((kind, url))
+            if url_buckets is not None:
+                url_buckets[url] = bucket
+        else:
+            log(f"User {user_id}: could not build {kind} url (gender={gender}, size={size})")
 
-        price_el = p.select_one(".price") or p.select_one(".special-price") or p.select_one("[data-price-amount]")
-        price_text = price_el.get_text(" ", strip=True) if price_el else ""
+    return urls
 
-        uid = link
+def plan_bucket_bands(ready_users: dict, mode: str):
+    """Price band per (kind, gender, size) bucket for the shared-listing modes"""
+    if mode not in ("union", "none"):
+        return None
 
-        items.append({
-            "id": uid,
-            "title": title,
-            "price": price_text,
-            "link": link,
-            "img": img,
-        })
+    bands = {}
+    for u in ready_users.values():
+        price_min, price_max = user_price_band(u)
+        for bucket in user_buckets(u):
+            if mode == "none":
+                bands[bucket] = (None, None)
+            elif bucket in bands:
+                lo, hi = bands[bucket]
+                bands[bucket] = (min(lo, price_min), max(hi, price_max))
+            else:
+                bands[bucket] = (price_min, price_max)
+    return bands
+
+def plan_scan(user_data: dict, shoes_size_map: dict, apparel_size_map: dict, mode: str = PRICE_FILTER_MODE):
+    """
+    Planning phase: work out which listing URLs every ready user needs.
+    Returns (user_plans, distinct_urls, url_buckets) where user_plans maps
+    user_id -> [(kind, url)], distinct_urls holds each listing once, in first-seen
+    order, and url_buckets maps each listing to its (kind, gender, size) bucket.
+    """
+    ready_users = {}
+    for user_id, u in user_data.items():
+        chat_id = u.get("chat_id")
+        if not isinstance(chat_id, int):
+            log(f"Skip user {user_id}: invalid chat_id")
+            continue
 
-    seen = set()
-    out = []
-    for it in items:
-        if it["id"] in seen:
+        if u.get("state") != "ready":
+            log(f"Skip user {user_id}: state={u.get('state')}")
             continue
-        seen.add(it["id"])
-        out.append(it)
-    return out
 
-def fetch_url_html(playwright, url: str):
-    browser = None
-    try:
-        browser = playwright.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(url, wait_until="domcontentloaded", timeout=60000)
-        page.wait_for_timeout(2000)
-        html = page.content()
-        return html
-    except Exception as e:
-        log(f"Error fetching URL {url}: {e}")
-        return ""
-    finally:
-        if browser:
-            try:
-                browser.close()
-            except:
-                pass
+        ready_users[user_id] = u
 
-def check_and_send_for_user(pw, user_id: str, u: dict, global_state: dict, shoes_size_map: dict, apparel_size_map: dict):
-    chat_id = u.get("chat_id")
-    if not isinstance(chat_id, int):
-        log(f"Skip user {user_id}: invalid chat_id")
-        return
+    bucket_bands = plan_bucket_bands(ready_users, mode)
 
-    if u.get("state") != "ready":
-        log(f"Skip user {user_id}: state={u.get('state')}")
-        return
+    user_plans = {}
+    distinct_urls = []
+    seen_urls = set()
+    url_buckets = {}
 
-    gender = u.get("gender")
-    category = u.get("category")
-    price_min = int(u.get("price_min", 0))
-    price_max = int(u.get("price_max", 999999))
+    for user_id, u in ready_users.items():
+        urls = build_user_urls(user_id, u, shoes_size_map, apparel_size_map, bucket_bands, url_buckets)
+        user_plans[user_id] = urls
 
-    urls = []
+        for _kind, url in urls:
+            if url not in seen_urls:
+                seen_urls.add(url)
+                distinct_urls.append(url)
 
-    if category in ("shoes", "both"):
-        shoe_size = u.get("shoes_size") or u.get("size")
-        if shoe_size:
-            url = build_shoes_url(gender, str(shoe_size), price_min, price_max, shoes_size_map)
-            if url:
-                urls.append(("shoes", url))
-            else:
-                log(f"User {user_id}: could not build shoes url (gender={gender}, shoe_size={shoe_size})")
-
-    if category in ("clothing", "both"):
-        clothing_size = u.get("clothing_size")
-        if clothing_size:
-            url = build_clothing_url(gender, str(clothing_size), price_min, price_max, apparel_size_map)
-            if url:
-                urls.append(("clothing", url))
-            else:
-                log(f"User {user_id}: could not build clothing url (gender={gender}, clothing_size={clothing_size})")
+    log(f"Scan plan ({mode} price filter): {len(user_plans)} ready users, {len(distinct_urls)} distinct listing URLs")
+    return user_plans, distinct_urls, url_buckets
+
+def filter_by_price(items, price_min: int, price_max: int):
+    """Apply a user's price range locally; items without a readable price are kept"""
+    out = []
+    for it in items:
+        price = extract_price(it.get("price", ""))
+        if price is None or price_min <= price <= price_max:
+            out.append(it)
+    return out
+
+def fetch_pages_browser(urls, engine: str = "sync"):
+    """Render every URL in Chromium with the chosen engine. Returns url -> html"""
+    if not urls:
+        return {}
+
+    if engine == "async":
+        from async_scanner import fetch_pages_sync
+        with profiler.stage("fetch.browser_async_batch"):
+            return fetch_pages_sync(urls)
+
+    from playwright.sync_api import sync_playwright  # only runs that need the browser pay for the import
+
+    with sync_playwright() as pw, BrowserPool(pw) as pool:
+        pages = {url: fetch_url_html(pool, url) for url in urls}
+        log(f"Browser pool stats: {json.dumps(pool.stats())}")
+    return pages
+
+def wants_http(record, now: int):
+    if not record or record.get("strategy") != "browser":
+        return True
+    return now - record.get("checked_at", 0) >= STRATEGY_REPROBE_SECONDS
+
+def fetch_listings(urls, engine: str = "sync", known=None):
+    """
+    Fetch and scrape each distinct listing URL once. Returns (listings, pages):
+    url -> items, and url -> {"etag", "last_modified", "page"} of each page used.
+    Plain HTTP is tried first; only listings whose static HTML has no products
+    go to the browser. The winning strategy per URL is remembered for next run;
+    a failed fetch (HTTP error, empty browser page) does not change it.
+
+    known maps listings nobody needs unless they changed to the validators of
+    their snapshot: those are fetched conditionally, and when the answer is a
+    304 or the same HTML as last time they are not parsed (items None).
+    """
+    started = time.perf_counter()
+    now = int(time.time())
+    known = known or {}
+    strategies = load_json(FETCH_STRATEGY_FILE, {})
+    listings = {}
+    pages = {}
+    no_tiles = set()  # static HTML came back fine but without products
+
+    def unchanged(url, page):
+        return url in known and page["page"] == known[url].get("page")
+
+    http_urls = [url for url in urls if wants_http(strategies.get(url), now)]
+    with profiler.stage("fetch.http_batch"):
+        static_pages = fetch_static_many(http_urls, known)
+    profiler.count("fetch.http_urls", len(http_urls))
+    for url, result in static_pages.items():
+        if result["not_modified"]:
+            listings[url] = None
+            strategies[url] = {"strategy": "http", "checked_at": now}
+            profiler.count("fetch.not_modified")
+            continue
+
+        html = result["html"]
+        page = {"etag": result["etag"], "last_modified": result["last_modified"], "page": page_fingerprint(html)}
+        if html and unchanged(url, page):
+            items = None
+            profiler.count("fetch.same_page")
+        else:
+            items = scrape_products(html, url) if html else []
+        if items is None or items or (html and EMPTY_LISTING_MARKER in html):
+            listings[url] = items
+            pages[url] = page
+            strategies[url] = {"strategy": "http", "checked_at": now}
+        elif html:
+            no_tiles.add(url)
+
+    browser_urls = [url for url in urls if url not in listings]
+    profiler.count("fetch.browser_urls", len(browser_urls))
+    browser_pages = fetch_pages_browser(browser_urls, engine)
+    for url in browser_urls:
+        html = browser_pages.get(url, "")
+        page = {"etag": None, "last_modified": None, "page": page_fingerprint(html)}
+        if html and unchanged(url, page):
+            listings[url] = None
+            profiler.count("fetch.same_page")
+        else:
+            listings[url] = scrape_products(html, url) if html else []
+        pages[url] = page
+        if html and url in no_tiles:
+            strategies[url] = {"strategy": "browser", "checked_at": now}
+
+    for url in urls:
+        found = "unchanged" if listings[url] is None else f"{len(listings[url])} items"
+        log(f"Listing scraped ({'browser' if url in browser_urls else 'http'}): {found} from {url}")
+
+    log(
+        f"Fetch phase: {len(urls)} URLs in {time.perf_counter() - started:.1f}s "
+        f"({len(urls) - len(browser_urls)} via http, {len(browser_urls)} via {engine} browser)"
+    )
+    save_json(FETCH_STRATEGY_FILE, strategies)
+    return listings, pages
+
+def cursor_key(url: str, price_min: int, price_max: int):
+    """A user's cursor slot for a listing; the band is part of it since it filters what they saw"""
+    return format(item_hash(f"{url}|{price_min}|{price_max}"), "016x")
+
+def pending_items(diff, cursor):
+    """
+    What a user still has to look at on a listing, given the fingerprint they
+    were last caught up with: nothing if that is the current one, only the
+    changed items if it is the previous snapshot, else the whole listing.
+    """
+    if diff is None:
+        return [], "full"
+    if diff.skipped:
+        return [], "skipped"
+    if diff.fingerprint is not None:
+        if cursor == diff.fingerprint:
+            return [], "caught_up"
+        if cursor is not None and cursor == diff.previous_fingerprint:
+            return diff.changed_items(), "incremental"
+    return diff.items, "full"
+
+def settled_listings(user_plans: dict, user_data: dict, global_state: dict, snapshots):
+    """
+    url -> snapshot validators for listings every user who scans them is
+    caught up with. If such a listing comes back unchanged, nobody needs its
+    items: it is not parsed, and fan-out skips it. A user whose sent entries
+    expire this run is not caught up anywhere, since expired items may be
+    sent again (check_and_send_for_user drops their cursors for the same reason).
+    """
+    fingerprints = {}
+    unsettled = set()
+    for user_id, urls in user_plans.items():
+        state = global_state.get(user_id) or {}
+        cursors = {} if SentItems.from_state(state).expiring() else state.get("cursors", {})
+        price_min, price_max = user_price_band(user_data[user_id])
+        for _, url in urls:
+            if url not in fingerprints:
+                fingerprints[url] = snapshots.fingerprint(url)
+            if fingerprints[url] is None or cursors.get(cursor_key(url, price_min, price_max)) != fingerprints[url]:
+                unsettled.add(url)
+    return {url: snapshots.validators(url) for url in fingerprints if url not in unsettled}
+
+def check_and_send_for_user(user_id: str, u: dict, urls: list, diffs: dict, global_state: dict, delivery):
+    chat_id = u.get("chat_id")
+    price_min, price_max = user_price_band(u)
 
     if not urls:
-        send_message(chat_id, "❌ Cannot build URL from your settings. Try /reset and setup again.")
+        delivery.send_message(chat_id, "❌ Cannot build URL from your settings. Try /reset and setup again.")
         return
 
     user_state = global_state.get(user_id, {})
-    sent_ids = set(user_state.get("sent_ids", []))
+    sent_items = SentItems.from_state(user_state)
+    expired = sent_items.expire()
+
+    # Per listing, the snapshot fingerprint the user was last fully caught up
+    # with. An expired entry may be sent again, which only a full pass notices.
+    old_cursors = {} if expired else user_state.get("cursors", {})
+    cursors = {}
+    for _, url in urls:
+        key = cursor_key(url, price_min, price_max)
+        if key in old_cursors:
+            cursors[key] = old_cursors[key]
     
     # Debug: show current state
-    log(f"User {user_id}: loaded {len(sent_ids)} previously sent items")
+    log(f"User {user_id}: loaded {len(sent_items)} previously sent items ({expired} expired)")
 
-    total_found = 0
     total_new = 0
+    capped = False
+
+    photos = []  # (img, caption) pairs, sent as albums once the scan is done
 
-    all_items = []  # Collect all items for smart alerts
-    
     for kind, url in urls:
-        log(f"User {user_id} scan {kind} URL: {url}")
-        html = fetch_url_html(pw, url)
-        items = scrape_products(html, url)
-        total_found += len(items)
-        all_items.extend(items)  # Add to smart alerts processing
+        diff = diffs.get(url)
+        key = cursor_key(url, price_min, price_max)
+        candidates, mode = pending_items(diff, old_cursors.get(key))
+        profiler.count(f"fan_out.{mode}")
+        log(f"User {user_id} scan {kind} URL ({mode}, {len(candidates)} candidates): {url}")
+
+        items = filter_by_price(candidates, price_min, price_max)
+        drops = diff.price_drops() if diff is not None else {}
 
         for it in items:
-            # Debug: check if item was sent before
-            if it["id"] in sent_ids:
-                log(f"User {user_id}: skipping already sent item {it['id'][:50]}...")
-                continue
-            
-            log(f"User {user_id}: sending new item {it['id'][:50]}...")
-
-            # Check if this is a price alert
-            current_price = extract_price(it.get("price", ""))
-            price_alert = ""
-            
-            if current_price and current_price <= price_max:
-                from smart_alerts import update_price_history
-                product_history = update_price_history(it["id"], current_price, it.get("title", ""))
-                
-                if current_price == product_history["lowest_price"]:
-                    price_alert = "🔥 LOWEST PRICE EVER!\n"
-                elif current_price < product_history.get("previous_lowest", 999999):
-                    price_alert = "🔥 PRICE DROP ALERT!\n"
-            
-            # Enhanced caption with price history and alerts
-            price_history = get_price_history_summary(it["id"])
-            
-            caption = f"{price_alert}{it['title']}\n{it['price']}\n{it['link']}\n\n"
-            caption += f"{price_history}\n\n"
-            caption += f"📤 Share: /share_{it['id'].split('/')[-1][:10]}"
-            
-            if it["img"]:
-                send_photo(chat_id, it["img"], caption[:950])  # Telegram limit
+            if sent_items.contains(it["id"]):
+                if it["id"] not in drops:
+                    continue
+                old_price, new_price = drops[it["id"]]
+                log(f"User {user_id}: sending price drop {it['id'][:50]}...")
+                delivery.send_message(
+                    chat_id,
+                    f"📉 PRICE DROP: {it['title']}\n{old_price} → {it['price']}\n{it['link']}"[:950]
+                )
             else:
-                send_message(chat_id, caption[:950])
+                log(f"User {user_id}: sending new item {it['id'][:50]}...")
+
+                # Price history was updated once per listing in the diff stage
+                current_price = extract_price(it.get("price", ""))
+                product_history = get_price_product(it["id"]) if current_price else None
+                price_alert = ""
+
+                if product_history and current_price <= price_max:
+                    if current_price == product_history["lowest_price"]:
+                        price_alert = "🔥 LOWEST PRICE EVER!\n"
+                    elif current_price < product_history.get("previous_lowest", 999999):
+                        price_alert = "🔥 PRICE DROP ALERT!\n"
+
+                # Enhanced caption with price history and alerts
+                price_history = get_price_history_summary(it["id"])
+
+                caption = f"{price_alert}{it['title']}\n{it['price']}\n{it['link']}\n\n"
+                caption += f"{price_history}\n\n"
+                caption += f"📤 Share: /share_{it['id'].split('/')[-1][:10]}"
 
-            sent_ids.add(it["id"])
+                if it["img"]:
+                    photos.append((it["img"], caption[:950]))  # Telegram limit
+                else:
+                    delivery.send_message(chat_id, caption[:950])
+
+                sent_items.add(it["id"])
             total_new += 1
-            
-            # Prevent overwhelming Telegram API
-            time.sleep(1)  # Increased from 0.5 to 1 second
-            
+
             # Limit products per user per run
-            if total_new >= 20:
-                log(f"User {user_id}: Reached max products limit (20), stopping")
-                send_message(chat_id, "⚠️ Found many products! Showing first 20. More will be sent in next scan.")
+            if total_new >= MAX_ITEMS_PER_RUN:
+                log(f"User {user_id}: Reached max products limit ({MAX_ITEMS_PER_RUN}), stopping")
+                capped = True
                 break
-    
-    # Smart alerts are now integrated into individual product messages
-    # No separate alert processing needed
+
+        if capped:
+            # Unfinished listings keep their old cursor, which only ever
+            # matches a snapshot the user has fully seen
+            break
+        # A skipped listing was not looked at: whatever cursor the user had stands
+        if diff is not None and diff.fingerprint is not None and not diff.skipped:
+            cursors[key] = diff.fingerprint
+
+    # Up to 10 photos per sendMediaGroup call; the queue paces the calls
+    delivery.send_photos(chat_id, photos)
+
+    if capped:
+        delivery.send_message(
+            chat_id,
+            f"⚠️ Found many products! Showing first {MAX_ITEMS_PER_RUN}. More will be sent in next scan."
+        )
 
     # Save updated state for this user
-    global_state[user_id] = {"sent_ids": list(sent_ids)}
+    global_state[user_id] = sent_items.to_state()
+    if cursors:
+        global_state[user_id]["cursors"] = cursors
     
     # Debug: show what was saved
-    log(f"User {user_id}: saved {len(sent_ids)} sent_ids to state")
+    log(f"User {user_id}: saved {len(sent_items)} sent items to state")
 
     # Send live coupons after products
     try:
-        coupon_message = get_formatted_coupons()
-        send_message(chat_id, coupon_message)
+        with profiler.stage("coupons.format"):
+            coupon_message = get_formatted_coupons()
+        delivery.send_message(chat_id, coupon_message)
     except Exception as e:
         log(f"Error fetching live coupons: {e}")
     
     # Remove summary message - not needed
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scan Timberland listings and send new products to users")
+    parser.add_argument("--engine", choices=("sync", "async"), default=os.getenv("SCAN_ENGINE", "sync"),
+                        help="listing fetch engine: one page at a time, or concurrent pages via asyncio")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each stage and write a JSON summary to RUN_PROFILE_OUTPUT at the end")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="with --profile, also dump cProfile stats to RUN_CPROFILE_OUTPUT")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.profile or args.cprofile:
+        profiler.enable(cprofile=args.cprofile)
+    try:
+        run(args)
+    finally:
+        profiler.report()
+
+def run(args):
     if not TELEGRAM_BOT_TOKEN:
         raise SystemExit("Missing TELEGRAM_BOT_TOKEN in GitHub Secrets.")
 
@@ -347,26 +513,83 @@ def main():
     else:
         log(f"Checker allowed: send window {now_il.strftime('%H:%M')}")
 
-    user_data = load_json(USER_DATA_FILE, {})
+    store = get_store()
+    with profiler.stage("state.load"):
+        user_data = store.load_users()
     log(f"user_data loaded keys: {list(user_data.keys())}")
 
     if not user_data:
-        log("No registered users found in user_data.json")
+        log("No registered users found")
         return
 
-    global_state = load_json(STATE_FILE, {})
+    with profiler.stage("state.load"):
+        global_state = store.load_sent_state()
 
     shoes_size_map = load_json(SHOES_SIZE_MAP_FILE, {})
     apparel_size_map = load_json(APPAREL_SIZE_MAP_FILE, {})
 
-    with sync_playwright() as pw:
-        for user_id, u in user_data.items():
-            check_and_send_for_user(pw, user_id, u, global_state, shoes_size_map, apparel_size_map)
+    with profiler.stage("plan"):
+        user_plans, distinct_urls, url_buckets = plan_scan(user_data, shoes_size_map, apparel_size_map)
+
+    snapshots = ListingSnapshots(store)
+    settled = settled_listings(user_plans, user_data, global_state, snapshots)
+
+    with profiler.stage("fetch"):
+        listings, pages = fetch_listings(distinct_urls, args.engine, settled)
+
+    # One diff per listing; stock alerts, price history and every user's
+    # fan-out work from its events
+    with profiler.stage("diff"):
+        diffs = snapshots.diff_all(listings, pages)
+    events = count_events(diffs)
+    for name, n in events.items():
+        profiler.count(f"diff.{name}", n)
+    log(f"Listing diff: {events}")
+    if diffs:
+        log(
+            f"Skip rate: {events['skipped']}/{len(diffs)} listings unchanged and not parsed "
+            f"({events['skipped'] / len(diffs):.0%}, {len(settled)} eligible), "
+            f"{events['unchanged']} more parsed with the same products"
+        )
+
+    with profiler.stage("price_history.update"):
+        record_listing_prices(diffs)
+
+    try:
+        with profiler.stage("coupons.prefetch"):
+            prefetch_coupons()
+    except Exception as e:
+        log(f"Error prefetching live coupons: {e}")
 
-    save_json(STATE_FILE, global_state)
+    # Users are scanned back to back; their messages drain concurrently from the queue
+    delivery = DeliveryQueue()
+    delivery.start()
+    try:
+        try:
+            with profiler.stage("stock_alerts"):
+                check_stock_alerts(diffs, url_buckets, user_data, delivery)
+        except Exception as e:
+            log(f"Error checking stock alerts: {e}")
+
+        with profiler.stage("fan_out"):
+            for user_id, urls in user_plans.items():
+                with profiler.stage("fan_out.user"):
+                    check_and_send_for_user(user_id, user_data[user_id], urls, diffs, global_state, delivery)
+    finally:
+        # Mostly rate-limit pacing: whatever the workers have not sent yet
+        with profiler.stage("delivery.drain"):
+            delivery.close()
+        for name, n in delivery.stats.items():
+            profiler.count(f"delivery.{name}", n)
+
+    with profiler.stage("state.save"):
+        store.save_sent_state(global_state)
+        snapshots.save(set(distinct_urls))
+    with profiler.stage("price_history.flush"):
+        flush_price_history()
     
     # Debug: show final state
-    total_tracked = sum(len(user_state.get("sent_ids", [])) for user_state in global_state.values())
+    total_tracked = count_entries(global_state)
     log(f"Checker done. Total tracked items across all users: {total_tracked}")
     log("Checker with smart alerts done.")
 
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# user_index.py - Inverted index from listing buckets to the users watching them
+#
+# Users are grouped by the (kind, gender, size) listing bucket they subscribe
+# to ("both" users sit in a shoes and a clothing bucket). Inside a bucket the
+# users are sorted by price_max, so "who wants an item at this price" is one
+# dict lookup plus a bisect, and the rest of the bucket from that point is the
+# answer: O(log n + matches) per item instead of a scan over every user.
+# Bucket None holds every ready user, for items whose bucket is not known.
+from bisect import bisect_left
+
+DEFAULT_PRICE_MAX = 999999
+
+def user_buckets(u: dict):
+    """(kind, gender, size) listing buckets a user subscribes to"""
+    gender = u.get("gender")
+    category = u.get("category")
+    buckets = []
+
+    if category in ("shoes", "both"):
+        shoe_size = u.get("shoes_size") or u.get("size")
+        if shoe_size:
+            buckets.append(("shoes", gender, str(shoe_size)))
+
+    if category in ("clothing", "both"):
+        clothing_size = u.get("clothing_size")
+        if clothing_size:
+            buckets.append(("clothing", gender, str(clothing_size).upper()))
+
+    return buckets
+
+def _price_max(u: dict):
+    try:
+        return int(u.get("price_max", DEFAULT_PRICE_MAX))
+    except (TypeError, ValueError):
+        return DEFAULT_PRICE_MAX
+
+class UserIndex:
+    def __init__(self, user_data: dict):
+        entries = {None: []}
+        for user_id, u in user_data.items():
+            if u.get("state") != "ready":
+                continue
+            entry = (_price_max(u), user_id)
+            entries[None].append(entry)
+            for bucket in user_buckets(u):
+                entries.setdefault(bucket, []).append(entry)
+
+        # bucket -> (ascending price_max list, user ids in the same order)
+        self.buckets = {}
+        for bucket, rows in entries.items():
+            rows.sort()
+            self.buckets[bucket] = ([p for p, _ in rows], [uid for _, uid in rows])
+
+    def __len__(self):
+        return len(self.buckets[None][0])
+
+    def match(self, bucket, price):
+        """Ids of users in bucket whose price_max is at least price"""
+        found = self.buckets.get(bucket)
+        if not found:
+            return []
+        prices, user_ids = found
+        return user_ids[bisect_left(prices, price):]
+
+    def stats(self):
+        sizes = [len(prices) for bucket, (prices, _) in self.buckets.items() if bucket is not None]
+        return {
+            "users": len(self),
+            "buckets": len(sizes),
+            "largest_bucket": max(sizes, default=0),
+        }